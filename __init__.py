@@ -1,16 +1,29 @@
-from aqt import mw
-from .closet_note_updater import closet_note_updater
-from .hooks import init_hooks
+import time
 
-from .control import closet_controller
+try:
+    from aqt import gui_hooks, mw
+except ImportError:
+    # Outside Anki, e.g. the command-line processor in cli.py, only the GUI-free modules are used
+    mw = None
 
-from aqt import mw
+# Worker processes of the parallel rebuild import this package without a main window
+if mw is not None:
+    import_start = time.perf_counter()
+    from .hook_registry import hook_registry
+    from .perf_stats import perf_stats
 
-mw.addonManager.setWebExports(__name__, r"web.*")
+    def on_profile_did_open():
+        """Loads and wires the add-on once a profile is open; later opens only queue the session maintenance"""
+        start = time.perf_counter()
+        from .closet_note_updater import closet_note_updater
+        from .control import init_controller
+        from .hooks import init_hooks
 
-def init():
-    init_hooks()
-    closet_controller
-    closet_note_updater.init()
+        init_hooks()
+        init_controller()
+        closet_note_updater.on_profile_did_open()
+        perf_stats.record_timing("startup_profile_open", time.perf_counter() - start)
 
-init()
+    mw.addonManager.setWebExports(__name__, r"web.*")
+    hook_registry.register(gui_hooks.profile_did_open, on_profile_did_open)
+    perf_stats.record_timing("startup_import", time.perf_counter() - import_start)
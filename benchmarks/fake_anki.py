@@ -0,0 +1,389 @@
+"""Headless stand-ins for the parts of aqt and mw.col the add-on uses.
+
+Notes live in an in-memory SQLite table shaped like Anki's own notes
+table, so the raw SQL paths of the add-on run unchanged.
+"""
+import copy
+import sqlite3
+import sys
+import time
+import types
+
+FIELD_SEPARATOR = "\x1f"
+
+class Dummy:
+    """Accepts any constructor arguments, attribute access and call"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return Dummy()
+
+    def __call__(self, *args, **kwargs):
+        return Dummy()
+
+class FakeHook:
+    def __init__(self, name):
+        self.name = name
+        self._hooks = []
+
+    def append(self, callback):
+        self._hooks.append(callback)
+
+    def remove(self, callback):
+        if callback in self._hooks:
+            self._hooks.remove(callback)
+
+    def __call__(self, *args):
+        for callback in list(self._hooks):
+            callback(*args)
+
+    def filter(self, value, *args):
+        for callback in list(self._hooks):
+            value = callback(value, *args)
+        return value
+
+class FakeDB:
+    def __init__(self):
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.connection.execute(
+            "create table notes (id integer primary key, guid text, mid integer not null, "
+            "mod integer not null, usn integer not null, tags text, flds text not null, "
+            "sfld text, csum integer, flags integer, data text)"
+        )
+        self.connection.execute("create index ix_notes_mid on notes (mid)")
+
+    def execute(self, sql, *args):
+        return self.connection.execute(sql, args).fetchall()
+
+    def list(self, sql, *args):
+        return [row[0] for row in self.execute(sql, *args)]
+
+    def scalar(self, sql, *args):
+        row = self.connection.execute(sql, args).fetchone()
+        return row[0] if row else None
+
+    def all(self, sql, *args):
+        return self.execute(sql, *args)
+
+    def first(self, sql, *args):
+        return self.connection.execute(sql, args).fetchone()
+
+class FakeModels:
+    def __init__(self, col):
+        self.col = col
+        self.models = {}
+        self.saves = 0
+
+    def get(self, mid):
+        model = self.models.get(mid)
+        return copy.deepcopy(model) if model else None
+
+    def by_name(self, name):
+        for model in self.models.values():
+            if model["name"] == name:
+                return copy.deepcopy(model)
+        return None
+
+    def all_names_and_ids(self):
+        return [types.SimpleNamespace(id=mid, name=model["name"]) for mid, model in self.models.items()]
+
+    def new_field(self, name):
+        return {"name": name, "ord": None}
+
+    newField = new_field
+
+    def add_field(self, model, field):
+        model["flds"].append(field)
+
+    addField = add_field
+
+    def field_map(self, model):
+        return {field["name"]: (index, field) for index, field in enumerate(model["flds"])}
+
+    def field_names(self, model):
+        return [field["name"] for field in model["flds"]]
+
+    def save(self, model):
+        self.saves += 1
+        old = self.models.get(model["id"])
+        added = len(model["flds"]) - len(old["flds"]) if old else 0
+        self.models[model["id"]] = copy.deepcopy(model)
+        if added > 0:
+            # Pad every note of the model with the new empty fields, as Anki does
+            rows = self.col.db.execute("select id, flds from notes where mid = ?", model["id"])
+            self.col.db.connection.executemany(
+                "update notes set flds = ? where id = ?",
+                [(flds + FIELD_SEPARATOR * added, note_id) for note_id, flds in rows]
+            )
+
+    update_dict = save
+
+class FakeNote:
+    def __init__(self, col, model, note_id=0, fields=None, mod=0):
+        self.col = col
+        self.id = note_id
+        self.mid = model["id"]
+        self.mod = mod
+        self._fmap = {field["name"]: index for index, field in enumerate(model["flds"])}
+        self.fields = list(fields) if fields is not None else [""] * len(model["flds"])
+
+    def note_type(self):
+        return self.col.models.get(self.mid)
+
+    def keys(self):
+        return list(self._fmap)
+
+    def items(self):
+        return [(name, self.fields[index]) for name, index in self._fmap.items()]
+
+    def __getitem__(self, key):
+        return self.fields[self._fmap[key]]
+
+    def __setitem__(self, key, value):
+        self.fields[self._fmap[key]] = value
+
+    def __contains__(self, key):
+        return key in self._fmap
+
+    def load(self):
+        fresh = self.col.get_note(self.id)
+        self.__dict__.update(fresh.__dict__)
+
+class FakeCard:
+    def __init__(self, col, card_id, note_id):
+        self.col = col
+        self.id = card_id
+        self.nid = note_id
+        self._note = None
+
+    def note(self, reload=False):
+        if self._note is None or reload:
+            self._note = self.col.get_note(self.nid)
+        return self._note
+
+    def note_type(self):
+        return self.note().note_type()
+
+class FakeWebView:
+    def __init__(self):
+        self.evals = 0
+
+    def eval(self, js):
+        self.evals += 1
+
+class FakeEditor:
+    def __init__(self):
+        self.web = FakeWebView()
+        self.note = None
+
+class FakeCollection:
+    def __init__(self):
+        self.db = FakeDB()
+        self.models = FakeModels(self)
+        self.config = {}
+        self.undo_entries = 0
+        self.writes = 0
+        self._next_id = int(time.time() * 1000)
+
+    def new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def add_model(self, name, field_names, templates=(), css=""):
+        mid = self.new_id()
+        self.models.models[mid] = {
+            "id": mid,
+            "name": name,
+            "flds": [{"name": field_name, "ord": index} for index, field_name in enumerate(field_names)],
+            "tmpls": [dict(template) for template in templates],
+            "css": css,
+        }
+        return mid
+
+    def add_raw_notes(self, mid, rows, mod=1):
+        """Bulk-inserts notes given as lists of field values"""
+        notes = [(self.new_id(), mid, mod, FIELD_SEPARATOR.join(fields)) for fields in rows]
+        self.db.connection.executemany(
+            "insert into notes (id, guid, mid, mod, usn, tags, flds, sfld, csum, flags, data) "
+            "values (?, '', ?, ?, -1, '', ?, '', 0, 0, '')",
+            notes
+        )
+        return [note[0] for note in notes]
+
+    def get_note(self, note_id):
+        row = self.db.first("select mid, mod, flds from notes where id = ?", note_id)
+        if row is None:
+            raise sys.modules["anki.errors"].NotFoundError(f"note {note_id} not found")
+        mid, mod, flds = row
+        return FakeNote(self, self.models.models[mid], note_id, flds.split(FIELD_SEPARATOR), mod)
+
+    def find_notes(self, query):
+        if query.startswith("note:"):
+            model = self.models.by_name(query[len("note:"):])
+            if not model:
+                return []
+            return self.db.list("select id from notes where mid = ?", model["id"])
+        return self.db.list("select id from notes")
+
+    def update_note(self, note):
+        self.update_notes([note])
+
+    def update_notes(self, notes, skip_undo_entry=False):
+        mod = int(time.time())
+        self.db.connection.executemany(
+            "update notes set flds = ?, mod = ? where id = ?",
+            [(FIELD_SEPARATOR.join(note.fields), mod, note.id) for note in notes]
+        )
+        for note in notes:
+            note.mod = mod
+        self.writes += len(notes)
+        return types.SimpleNamespace(note_text=bool(notes))
+
+    def get_config(self, key, default=None):
+        return self.config.get(key, default)
+
+    def set_config(self, key, value, **kwargs):
+        self.config[key] = value
+
+    def add_custom_undo_entry(self, name):
+        self.undo_entries += 1
+        return self.undo_entries
+
+    def merge_undo_entries(self, target):
+        return types.SimpleNamespace(note_text=True)
+
+class FakeProgress:
+    def want_cancel(self):
+        return False
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def single_shot(self, delay, callback, *args):
+        pass
+
+    def timer(self, *args, **kwargs):
+        return Dummy()
+
+class FakeTaskManager:
+    def run_on_main(self, callback):
+        callback()
+
+    def run_in_background(self, task, on_done=None, *args, **kwargs):
+        result = task()
+        if on_done:
+            on_done(types.SimpleNamespace(result=lambda: result))
+
+class FakeMainWindow(Dummy):
+    def __init__(self, col):
+        self.col = col
+        self.progress = FakeProgress()
+        self.taskman = FakeTaskManager()
+        self.reviewer = None
+        self.state = "deckBrowser"
+        self.shown_messages = []
+
+class FakeCollectionOp:
+    """Runs the operation synchronously, as if the background thread finished instantly"""
+
+    def __init__(self, parent, op):
+        self._op = op
+        self._success = None
+        self._failure = None
+
+    def success(self, callback):
+        self._success = callback
+        return self
+
+    def failure(self, callback):
+        self._failure = callback
+        return self
+
+    def with_progress(self, label=None):
+        return self
+
+    def run_in_background(self, *, initiator=None):
+        try:
+            result = self._op(sys.modules["aqt"].mw.col)
+        except Exception as e:
+            if self._failure:
+                self._failure(e)
+                return
+            raise
+        if self._success:
+            self._success(result)
+
+class FakeQueryOp(FakeCollectionOp):
+    """Read-only counterpart of FakeCollectionOp, with the success callback given up front"""
+
+    def __init__(self, parent, op, success):
+        super().__init__(parent, op)
+        self._success = success
+
+class OpChangesWithCount:
+    def __init__(self, changes=None, count=0):
+        self.changes = changes
+        self.count = count
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+def _dummy_class(name):
+    return type(name, (Dummy,), {})
+
+def install(col=None):
+    """Installs aqt (and anki, when it is not installed) stand-ins and returns the fake main window"""
+    col = col or FakeCollection()
+    mw = FakeMainWindow(col)
+
+    hooks = {}
+
+    def hook(name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return hooks.setdefault(name, FakeHook(name))
+
+    def qt_class(name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _dummy_class(name)
+
+    def show_info(message, *args, **kwargs):
+        mw.shown_messages.append(message)
+
+    aqt = _module("aqt", mw=mw)
+    aqt.gui_hooks = _module("aqt.gui_hooks", __getattr__=hook)
+    aqt.qt = _module("aqt.qt", __getattr__=qt_class)
+    aqt.utils = _module("aqt.utils", showInfo=show_info, tooltip=show_info, askUser=lambda *a, **k: True,
+                        getSaveFile=lambda *a, **k: None)
+    aqt.operations = _module("aqt.operations", CollectionOp=FakeCollectionOp, QueryOp=FakeQueryOp)
+    aqt.editor = _module("aqt.editor", Editor=_dummy_class("Editor"))
+    aqt.browser = _module("aqt.browser", Browser=_dummy_class("Browser"))
+    aqt.reviewer = _module("aqt.reviewer", Reviewer=_dummy_class("Reviewer"))
+
+    try:
+        import anki.collection  # noqa: F401
+    except ImportError:
+        anki = _module("anki")
+
+        class NotFoundError(Exception):
+            pass
+
+        class AbortSchemaModification(Exception):
+            pass
+
+        def ids2str(ids):
+            return "(" + ",".join(str(i) for i in ids) + ")"
+
+        anki.errors = _module("anki.errors", NotFoundError=NotFoundError,
+                              AbortSchemaModification=AbortSchemaModification)
+        anki.utils = _module("anki.utils", ids2str=ids2str,
+                             split_fields=lambda flds: flds.split(FIELD_SEPARATOR))
+        anki.collection = _module("anki.collection", OpChangesWithCount=OpChangesWithCount,
+                                  OpChanges=types.SimpleNamespace, SearchNode=types.SimpleNamespace)
+    return mw
@@ -0,0 +1,55 @@
+"""Synthetic Closet-r collections for the benchmarks."""
+import random
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud"
+).split()
+
+CLOSET_TEMPLATE = (
+    "<div class=\"deck-name\">{{Deck}}</div>\n"
+    "<div id=\"closet-block\">{{block}}</div>\n"
+    "<script>\n"
+    "// Stand-in for the inline Closet runtime shipped in the note type\n"
+    "%s\n"
+    "</script>\n"
+)
+
+def _words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+def generate_block(rng, tag_density=0.3, mix_ratio=0.1, block_length=60, max_tags=20):
+    """Returns one block of roughly block_length words where tag_density of the phrases are Closet tags"""
+    parts = []
+    numbers = rng.sample(range(1, max_tags * 2), max_tags)
+    mix_number = 1
+    for _ in range(max(1, block_length // 6)):
+        if rng.random() < tag_density:
+            if rng.random() < mix_ratio:
+                parts.append(f"[[mix{mix_number}::{_words(rng, 4)}]]")
+                mix_number += rng.random() < 0.5
+            else:
+                kind = rng.choice(("c", "c", "c", "cl", "cx"))
+                parts.append(f"[[{kind}{rng.choice(numbers)}::{_words(rng, 3)}]]")
+        else:
+            parts.append(_words(rng, 6))
+    return " ".join(parts)
+
+def populate(col, count, tag_density=0.3, mix_ratio=0.1, block_length=60, cmds_fields=20,
+             template_size=20000, note_type_name="Closet-r", seed=1):
+    """Adds a Closet-r note type and count synthetic notes to the fake collection; returns (mid, note ids)"""
+    rng = random.Random(seed)
+    field_names = ["block", "extra"] + [f"cmds{i}" for i in range(1, cmds_fields + 1)]
+    script = "var closetStandIn = %s;" % ("1 + " * (template_size // 4)) + "1;"
+    template = CLOSET_TEMPLATE % script
+    mid = col.add_model(
+        note_type_name,
+        field_names,
+        templates=[{"name": f"Card {i}", "qfmt": template, "afmt": template} for i in range(1, 4)],
+        css=".card { font-family: arial; }\n<style>.deck-name { opacity: 1; }</style>",
+    )
+    rows = []
+    for _ in range(count):
+        block = generate_block(rng, tag_density, mix_ratio, block_length)
+        rows.append([block, ""] + [""] * cmds_fields)
+    return mid, col.add_raw_notes(mid, rows)
@@ -0,0 +1,211 @@
+"""Headless benchmark suite for the Closet add-on.
+
+Runs the add-on's hot paths against an in-memory stand-in for mw.col
+filled with synthetic Closet-r notes and writes the timings as JSON:
+
+    python benchmarks/run.py --sizes 1000 10000 100000 --output bench.json
+    python benchmarks/run.py --baseline bench.json
+
+With --baseline, every timing is compared with the previous run and the
+exit status is 1 when one of them is slower than --threshold allows.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCHMARKS_DIR)
+PACKAGE = "closet_note_type_reloaded"
+
+sys.path.insert(0, BENCHMARKS_DIR)
+import fake_anki  # noqa: E402
+import generate  # noqa: E402
+
+def load_addon():
+    """Imports the add-on modules under the fake aqt without running the add-on's __init__"""
+    mw = fake_anki.install()
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [ADDON_DIR]
+    sys.modules[PACKAGE] = package
+    modules = types.SimpleNamespace(
+        updater=importlib.import_module(f"{PACKAGE}.closet_note_updater"),
+        control=importlib.import_module(f"{PACKAGE}.control"),
+        block_cache=importlib.import_module(f"{PACKAGE}.block_cache"),
+        tag_index=importlib.import_module(f"{PACKAGE}.tag_index"),
+        hide_fields=importlib.import_module(f"{PACKAGE}.editor.hide_fields"),
+    )
+    return mw, modules
+
+MIX_BLOCK = (
+    "To mix (shuffle) cards, there's a few ways to do it.\nMethod #1. To reorganize sentences:\n"
+    "[[mix1::This is my first sentence]], and here is the rest of the first phrase.\n"
+    "[[mix1::This is the second sentence]], and here is the last of this second phrase."
+)
+
+def check_addon(mw, modules, cache_dir):
+    """Sanity check run before timing anything: a mix1 block must activate cmds1 and only cmds1"""
+    mw.col = fake_anki.FakeCollection()
+    mid, (note_id,) = generate.populate(mw.col, 1, cmds_fields=3)
+    note = mw.col.get_note(note_id)
+    note["block"] = MIX_BLOCK
+    updater = modules.updater.ClosetNoteUpdater()
+    updater.cache = modules.block_cache.BlockCache(path=os.path.join(cache_dir, "check.sqlite3"))
+    updater.update_cmds_fields(note, silent=True)
+    note = mw.col.get_note(note_id)
+    assert (note["cmds1"], note["cmds2"]) == ("active", ""), "a mix1 block should only activate cmds1"
+
+def measure(function, repeat=1):
+    """Runs the function repeat times and returns its timings in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {"min_s": min(timings), "median_s": statistics.median(timings), "repeat": repeat}
+
+def run_size(mw, modules, size, args, cache_dir):
+    """Benchmarks one synthetic collection of the given size"""
+    mw.col = fake_anki.FakeCollection()
+    mid, note_ids = generate.populate(
+        mw.col, size,
+        tag_density=args.tag_density,
+        mix_ratio=args.mix_ratio,
+        block_length=args.block_length,
+        cmds_fields=args.cmds_fields,
+        template_size=args.template_size,
+    )
+    cache_path = os.path.join(cache_dir, f"block_cache_{size}.sqlite3")
+    updater = modules.updater.ClosetNoteUpdater()
+    updater.cache = modules.block_cache.BlockCache(path=cache_path)
+    updater.tag_index = modules.tag_index.TagIndex(path=os.path.join(cache_dir, f"tag_index_{size}.sqlite3"))
+    sample = note_ids[:min(size, args.sample)]
+    results = []
+
+    def record(name, timing, operations):
+        timing.update({
+            "benchmark": name,
+            "size": size,
+            "operations": operations,
+            "per_op_us": round(timing["min_s"] / operations * 1e6, 3) if operations else None,
+        })
+        results.append(timing)
+        print(f"{name:<28} size={size:<7} min={timing['min_s']:.4f}s per_op={timing['per_op_us']}us", file=sys.stderr)
+
+    writes_before = mw.col.writes
+    record("update_all_notes_cold", measure(lambda: updater.update_all_notes(silent=True)), size)
+    results[-1]["writes"] = mw.col.writes - writes_before
+    writes_before = mw.col.writes
+    record("update_all_notes_warm", measure(lambda: updater.update_all_notes(silent=True), args.repeat), size)
+    results[-1]["writes"] = (mw.col.writes - writes_before) // args.repeat
+
+    # A fresh updater reading the persisted cache, as right after a restart
+    restarted = modules.updater.ClosetNoteUpdater()
+    restarted.cache = modules.block_cache.BlockCache(path=cache_path)
+    record("update_all_notes_restart", measure(lambda: restarted.update_all_notes(silent=True)), size)
+
+    notes = [mw.col.get_note(note_id) for note_id in sample]
+    record("update_cmds_fields", measure(
+        lambda: [updater.update_cmds_fields(note, silent=True) for note in notes], args.repeat), len(notes))
+
+    blocks = [note["block"] for note in notes]
+    record("reorganize_tags", measure(
+        lambda: [updater.reorganize_tags(block) for block in blocks], args.repeat), len(blocks))
+
+    cards = [fake_anki.FakeCard(mw.col, note_id, note_id) for note_id in sample]
+    record("on_review_card_first", measure(
+        lambda: [updater.on_review_card(card) for card in cards]), len(cards))
+    record("on_review_card_repeat", measure(
+        lambda: [updater.on_review_card(card) for card in cards], args.repeat), len(cards))
+
+    # Loading notes of one note type into the same editor, as when browsing
+    editor = fake_anki.FakeEditor()
+    hide_fields = modules.hide_fields.HideCmdFields()
+
+    def load_notes():
+        for note in notes:
+            editor.note = note
+            hide_fields.on_editor_did_load_note(editor)
+
+    record("editor_load_note", measure(load_notes, args.repeat), len(notes))
+    results[-1]["evals"] = editor.web.evals
+
+    controller = modules.control.init_controller()
+    record("apply_css", measure(
+        lambda: controller.apply_css("Red", True, False), args.repeat), 1)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ADDON_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path, threshold):
+    """Prints the change against a previous run and returns whether any benchmark regressed"""
+    with open(baseline_path) as f:
+        baseline = {(r["benchmark"], r["size"]): r for r in json.load(f)["results"]}
+    regressed = False
+    for result in results:
+        previous = baseline.get((result["benchmark"], result["size"]))
+        if not previous or not previous["min_s"]:
+            continue
+        ratio = result["min_s"] / previous["min_s"]
+        flag = "REGRESSION" if ratio > threshold else ""
+        regressed = regressed or bool(flag)
+        print(f"{result['benchmark']:<28} size={result['size']:<7} x{ratio:.2f} {flag}", file=sys.stderr)
+    return regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--tag-density", type=float, default=0.3)
+    parser.add_argument("--mix-ratio", type=float, default=0.1)
+    parser.add_argument("--block-length", type=int, default=60)
+    parser.add_argument("--cmds-fields", type=int, default=20)
+    parser.add_argument("--template-size", type=int, default=20000)
+    parser.add_argument("--sample", type=int, default=2000, help="notes used by the per-note benchmarks")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON file to write, defaults to stdout")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    mw, modules = load_addon()
+    results = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        check_addon(mw, modules, cache_dir)
+        for size in args.sizes:
+            results.extend(run_size(mw, modules, size, args, cache_dir))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.baseline:
+        return 1 if compare(results, args.baseline, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
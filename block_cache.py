@@ -0,0 +1,195 @@
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from . import tokenizer
+
+USER_FILES_DIR = os.path.join(os.path.dirname(__file__), "user_files")
+
+class BlockCache:
+    """LRU cache of normalized blocks keyed by a hash of the block text, persisted in user_files"""
+
+    # Bump whenever the tokenizer output changes so stale entries are not reused
+    VERSION = 1
+    # Value of pragma auto_vacuum that lets compact_step shrink the file a few pages at a time
+    INCREMENTAL_VACUUM = 2
+
+    def __init__(self, max_entries=50000, path=None):
+        self.max_entries = max_entries
+        self.path = path or os.path.join(USER_FILES_DIR, "block_cache.sqlite3")
+        self.logger = logging.getLogger(__name__)
+        self.entries = OrderedDict()
+        self.touched = set()
+        self.hits = 0
+        self.misses = 0
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def key(cls, text):
+        """Returns the hash the block text is stored under"""
+        return hashlib.blake2b(f"{cls.VERSION}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        # Only takes effect on a new file; existing ones switch on their next vacuum
+        connection.execute(f"pragma auto_vacuum = {self.INCREMENTAL_VACUUM}")
+        connection.execute(
+            "create table if not exists blocks ("
+            "key blob primary key, normalized text, max_tag integer not null, used integer not null)"
+        )
+        return connection
+
+    def start_load(self):
+        """Marks the cache as loaded and returns the function that reads it, e.g. to run off the GUI thread
+
+        Returns None when the cache is already loaded or loading. Lookups made
+        while the entries are read are parsed as misses instead of waiting.
+        """
+        with self.lock:
+            if self.loaded:
+                return None
+            self.loaded = True
+        return self._read_entries
+
+    def load(self):
+        """Loads the most recently used entries from disk so lookups right after startup are hits"""
+        read_entries = self.start_load()
+        if read_entries is not None:
+            read_entries()
+
+    def _read_entries(self):
+        try:
+            connection = self._connect()
+            try:
+                rows = connection.execute(
+                    "select key, normalized, max_tag from blocks order by used desc limit ?",
+                    (self.max_entries,)
+                ).fetchall()
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error loading block cache: {str(e)}")
+            return
+        with self.lock:
+            # Entries stored while reading stay the most recently used ones
+            for key, normalized, max_tag in rows:
+                if key not in self.entries:
+                    self.entries[key] = (normalized, max_tag)
+                    self.entries.move_to_end(key, last=False)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                self.touched.discard(evicted)
+
+    def normalize(self, text):
+        """Returns the normalized block text and its max tag number, parsing it only on a cache miss"""
+        if not text:
+            return text, 0
+        if not self.loaded:
+            self.load()
+        key = self.key(text)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.touched.add(key)
+                self.hits += 1
+                normalized, max_tag = entry
+                return (text if normalized is None else normalized), max_tag
+        normalized, max_tag = tokenizer.normalize(text)
+        with self.lock:
+            self.misses += 1
+        self.store(text, normalized, max_tag, key)
+        return normalized, max_tag
+
+    def contains(self, text):
+        """Tells whether the block is cached, without counting a lookup"""
+        if not self.loaded:
+            self.load()
+        with self.lock:
+            return self.key(text) in self.entries
+
+    def store(self, text, normalized, max_tag, key=None):
+        """Adds a block normalized elsewhere, e.g. by a worker process"""
+        key = key or self.key(text)
+        with self.lock:
+            # Unchanged blocks, the common case, are stored without a copy of the text
+            self.entries[key] = (None if normalized == text else normalized, max_tag)
+            self.entries.move_to_end(key)
+            self.touched.add(key)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                self.touched.discard(evicted)
+
+    def flush(self):
+        """Writes the entries used since the last flush to disk and evicts the least recently used ones"""
+        with self.lock:
+            if not self.touched:
+                return
+            order = {key: index for index, key in enumerate(self.entries)}
+            rows = [
+                (key, *self.entries[key], order[key])
+                for key in self.touched if key in self.entries
+            ]
+            self.touched = set()
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    base = connection.execute("select coalesce(max(used), 0) + 1 from blocks").fetchone()[0]
+                    connection.executemany(
+                        "insert or replace into blocks (key, normalized, max_tag, used) values (?, ?, ?, ?)",
+                        [(key, normalized, max_tag, base + index) for key, normalized, max_tag, index in rows]
+                    )
+                    connection.execute(
+                        "delete from blocks where key not in (select key from blocks order by used desc limit ?)",
+                        (self.max_entries,)
+                    )
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving block cache: {str(e)}")
+
+    def compact_step(self, max_pages=256, min_free_ratio=0.25):
+        """Gives at most max_pages pages left by evicted entries back to the file system; returns whether more remain
+
+        Files in incremental auto-vacuum mode shrink a few pages per call. Older files
+        are vacuumed once, which also switches them to that mode, and only when at
+        least min_free_ratio of their pages are free.
+        """
+        try:
+            connection = self._connect()
+            try:
+                free_pages = connection.execute("pragma freelist_count").fetchone()[0]
+                if not free_pages:
+                    return False
+                if connection.execute("pragma auto_vacuum").fetchone()[0] == self.INCREMENTAL_VACUUM:
+                    # executescript steps the pragma to completion; execute would free a single page
+                    connection.executescript(f"pragma incremental_vacuum({int(max_pages)});")
+                    return free_pages > max_pages
+                page_count = connection.execute("pragma page_count").fetchone()[0]
+                if free_pages / page_count >= min_free_ratio:
+                    connection.execute(f"pragma auto_vacuum = {self.INCREMENTAL_VACUUM}")
+                    connection.execute("vacuum")
+                return False
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error compacting block cache: {str(e)}")
+            return False
+
+    def hit_rate(self):
+        """Returns the fraction of lookups answered from the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 4),
+        }
@@ -0,0 +1,198 @@
+from typing import NamedTuple
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from anki.collection import (
+    Collection,
+    ExportAnkiPackageOptions,
+    ImportAnkiPackageOptions,
+    ImportAnkiPackageRequest,
+    NoteIdsLimit,
+)
+from . import core
+from . import scan
+from .block_cache import BlockCache
+from .config import load_config
+from .note_types import ClosetNoteTypeRegistry
+from .parallel import ParallelNormalizer
+from .provisioning import FieldProvisioner
+
+class BatchResult(NamedTuple):
+    """What one batch run read and wrote"""
+    notes: int
+    written: int
+    models_provisioned: int
+    elapsed: float
+
+    @property
+    def notes_per_second(self):
+        return self.notes / self.elapsed if self.elapsed else 0.0
+
+    def describe(self, dry_run=False):
+        return "\n".join([
+            f"Closet notes: {self.notes}",
+            f"Notes {'to write' if dry_run else 'written'}: {self.written}",
+            f"Note types given more cmds fields: {self.models_provisioned}",
+            f"Elapsed: {self.elapsed:.2f} s ({self.notes_per_second:.0f} notes/s)",
+        ])
+
+class BatchProcessor:
+    """Normalizes every Closet note of a collection without Anki's GUI
+
+    The notes are streamed from the notes table in chunks, their blocks are
+    normalized in a process pool, and all changed notes are written back with a
+    single update_notes call, i.e. in one transaction.
+    """
+
+    CHUNK_SIZE = 1000
+
+    def __init__(self, note_type_names, workers=0, headroom=0, cache_path=None, cache_size=50000):
+        self.note_types = ClosetNoteTypeRegistry(note_type_names)
+        self.cache = BlockCache(max_entries=cache_size, path=cache_path)
+        # Every run is a full rebuild, so the pool is used whenever there is more than one worker
+        self.parallel = ParallelNormalizer(workers, min_notes=0)
+        self.provisioner = FieldProvisioner(headroom=headroom)
+
+    def process(self, col, dry_run=False):
+        start = time.perf_counter()
+        total = scan.count_notes(col, self.note_types)
+        chunks = scan.iter_chunks(col, self.note_types, None, self.CHUNK_SIZE)
+        if self.parallel.should_run(total):
+            chunks = self.parallel.prewarm(chunks, self.cache)
+        pending = []
+        # Highest tag number per note type among the notes lacking cmds fields
+        missing_fields = {}
+        scanned = 0
+        for chunk in chunks:
+            scanned += len(chunk)
+            for raw in chunk:
+                normalized, max_tag_num = self.cache.normalize(raw.block)
+                if self.note_types.get(col, raw.mid).lacks_fields(max_tag_num):
+                    missing_fields[raw.mid] = max(missing_fields.get(raw.mid, 0), max_tag_num)
+                    pending.append(raw.id)
+                elif core.raw_needs_write(raw, normalized, max_tag_num):
+                    pending.append(raw.id)
+        self.cache.flush()
+        if dry_run:
+            return BatchResult(scanned, len(pending), len(missing_fields), time.perf_counter() - start)
+
+        provisioned = 0
+        for mid, highest in missing_fields.items():
+            if self.provisioner.ensure(col, mid, highest):
+                provisioned += 1
+        if provisioned:
+            self.note_types.invalidate()
+        notes = []
+        for note_id in pending:
+            note = col.get_note(note_id)
+            changed, _ = core.normalize_fields(self.cache, self.note_types.get(col, note.mid), note.fields)
+            if changed:
+                notes.append(note)
+        col.update_notes(notes, skip_undo_entry=True)
+        return BatchResult(scanned, len(notes), provisioned, time.perf_counter() - start)
+
+def default_output(path):
+    stem, extension = os.path.splitext(path)
+    return f"{stem}-closet{extension}"
+
+def open_collection(path, workdir):
+    """Opens a collection file, or unpacks an .apkg or .colpkg into a collection in workdir"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in ('.apkg', '.colpkg'):
+        return Collection(path)
+    col_path = os.path.join(workdir, "collection.anki2")
+    if extension == '.colpkg':
+        # Importing a collection package replaces a closed collection, so it goes through the backend directly
+        from anki._backend import RustBackend
+        RustBackend().import_collection_package(
+            col_path=col_path,
+            backup_path=os.path.abspath(path),
+            media_folder=os.path.join(workdir, "collection.media"),
+            media_db=os.path.join(workdir, "collection.media.db2"),
+        )
+        return Collection(col_path)
+    col = Collection(col_path)
+    col.import_anki_package(ImportAnkiPackageRequest(
+        package_path=os.path.abspath(path),
+        options=ImportAnkiPackageOptions(with_scheduling=True, with_deck_configs=True),
+    ))
+    return col
+
+def save_collection(col, path, output):
+    """Writes the collection back; packages are exported again to output, with their media"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.colpkg':
+        # Closes the collection
+        col.export_collection_package(os.path.abspath(output), include_media=True, legacy=False)
+        return
+    if extension == '.apkg':
+        col.export_anki_package(
+            out_path=os.path.abspath(output),
+            options=ExportAnkiPackageOptions(
+                with_scheduling=True, with_deck_configs=True, with_media=True, legacy=False
+            ),
+            limit=NoteIdsLimit(col.find_notes("")),
+        )
+    col.close()
+
+def main(argv=None):
+    config = load_config()
+    parser = argparse.ArgumentParser(
+        description="Normalizes the Closet notes of a collection.anki2, .apkg or .colpkg file without Anki."
+    )
+    parser.add_argument("path", help="collection.anki2, .apkg or .colpkg file; Anki must not have it open")
+    parser.add_argument("--output", help="where to write the result; defaults to <name>-closet.<ext> for packages "
+                                         "and to the collection itself")
+    parser.add_argument("--note-type", action="append", dest="note_types",
+                        help="Closet note type name; repeat for several (default: note_types of config.json)")
+    parser.add_argument("--workers", type=int, default=config["parallel_workers"],
+                        help="normalizing processes; 0 uses one less than the number of CPUs, 1 runs serially")
+    parser.add_argument("--cache", help="block cache file (default: the add-on's user_files/block_cache.sqlite3)")
+    parser.add_argument("--dry-run", action="store_true", help="only count the notes that would be written")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+
+    if not os.path.exists(args.path):
+        parser.error(f"{args.path} does not exist")
+    is_package = os.path.splitext(args.path)[1].lower() in ('.apkg', '.colpkg')
+    output = args.output or (default_output(args.path) if is_package else args.path)
+    path = args.path
+    if not is_package and output != path and not args.dry_run:
+        # Processes a copy so the original collection stays untouched
+        shutil.copy2(path, output)
+        path = output
+
+    processor = BatchProcessor(
+        args.note_types or config["note_types"],
+        workers=args.workers,
+        headroom=config["cmds_field_headroom"],
+        cache_path=args.cache,
+        cache_size=config["block_cache_size"],
+    )
+    with tempfile.TemporaryDirectory() as workdir:
+        col = open_collection(path, workdir)
+        try:
+            result = processor.process(col, dry_run=args.dry_run)
+        except BaseException:
+            col.close()
+            raise
+        if args.dry_run:
+            col.close()
+        else:
+            save_collection(col, args.path, output)
+
+    print(result.describe(dry_run=args.dry_run))
+    if args.dry_run:
+        print("Dry run, nothing was written.")
+    else:
+        if result.models_provisioned:
+            print("Note type fields changed: the next sync of this collection is a full sync.")
+        print(f"Written to: {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,109 +1,318 @@
 from aqt import mw
-from aqt.utils import showInfo
-from aqt.qt import QAction
-from aqt import gui_hooks
-import re
+from aqt.utils import showInfo, tooltip
+from aqt.operations import CollectionOp, QueryOp
+from anki.collection import OpChangesWithCount
+from anki.errors import AbortSchemaModification, NotFoundError
+from anki.utils import ids2str
 import logging
+import time
+from . import core
+from . import scan
+from . import tokenizer
+from .block_cache import BlockCache
+from .config import load_config
+from .dirty_tracker import DirtyNoteTracker
+from .note_types import closet_note_types
+from .parallel import ParallelNormalizer
+from .perf_stats import perf_stats
+from .provisioning import FieldProvisioner
+from .scheduler import idle_scheduler
+from .tag_index import TagIndex
 
 class ClosetNoteUpdater:
+    UNDO_LABEL = "Update Closet Cards"
+    SCAN_CHUNK_SIZE = 500
+    IDLE_CHUNK_SIZE = 100
+    COMPACT_PAGES = 256
+    PREFETCH_COUNT = 5
+    PREFETCH_DELAY_MS = 300
+    MAX_REVIEW_STAMPS = 10000
+
     def __init__(self, note_type_name='Closet-r'):
         self.note_type_name = note_type_name
         self.logger = logging.getLogger(__name__)
+        self.dirty = DirtyNoteTracker()
+        self.note_types = closet_note_types
+        config = load_config()
+        self.provisioner = FieldProvisioner(headroom=config["cmds_field_headroom"])
+        self.cache = BlockCache(max_entries=config["block_cache_size"])
+        self.parallel_rebuild = config["parallel_rebuild"]
+        self.parallel = ParallelNormalizer(config["parallel_workers"], config["parallel_min_notes"])
+        perf_stats.add_source("block_cache", lambda: self.cache.stats())
+        # Aberto por perfil em on_profile_did_open
+        self.tag_index = TagIndex()
+        self._update_running = False
+        self._prefetch_running = False
+        self.review_stamps = {}
+
+    def closet_mids(self):
+        """Retorna os ids dos modelos de nota Closet existentes na coleção"""
+        return self.note_types.mids(mw.col)
 
     def count_tags(self, text):
         """Conta o número de tags [[c]], [[cl]], [[cx]], [[mix]] e [[mc]] no texto e retorna o maior número encontrado"""
         if not text:
             return 0
-        matches = re.findall(r'\[\[(?:c|cl|cx|mix|mc)(\d+)::', text)
-        return max(map(int, matches)) if matches else 0
+        return tokenizer.max_tag_number(tokenizer.tokenize(text))
 
     def reorganize_tags(self, text):
         """Reorganiza as tags c para que c6, c4 e c9 sejam tratados como c1, c2 e c3"""
-        tags = re.findall(r'\[\[c(\d+)::', text)
-        tags = sorted(set(map(int, tags)))
-        tag_map = {old: new for new, old in enumerate(tags, start=1)}
-        for old, new in tag_map.items():
-            text = re.sub(rf'\[\[c{old}::', rf'[[c{new}::', text)
-        return text
-
-    def ensure_fields_exist(self, note, max_tag_num):
-        """Garante que os campos cmds existam no modelo de nota"""
-        model = mw.col.models.get(note.mid)
-        field_names = [field['name'] for field in model['flds']]
-        for i in range(1, max_tag_num + 1):
-            field_name = f'cmds{i}'
-            if field_name not in field_names:
-                mw.col.models.addField(model, mw.col.models.newField(field_name))
-        mw.col.models.save(model)
+        return tokenizer.rebuild(text, tokenizer.tokenize(text), collapse_mix=False)[0]
+
+    def max_tag_num(self, text):
+        """Retorna o maior número de tag que o block terá depois de normalizado"""
+        return self.cache.normalize(text)[1]
+
+    def provision_fields(self, highest_by_mid):
+        """Cria de uma só vez, por modelo, os campos cmds que faltam; informa se algum campo foi criado
+
+        Mudanças de esquema podem pedir confirmação ao usuário, por isso rodam na thread principal.
+        """
+        provisioned = False
+        try:
+            for mid, highest in highest_by_mid.items():
+                if self.provisioner.ensure(mw.col, mid, highest):
+                    provisioned = True
+        except AbortSchemaModification:
+            self.logger.info("Adding cmds fields was declined by the user")
+        if provisioned:
+            self.note_types.invalidate()
+        return provisioned
+
+    def normalize_note(self, note):
+        """Normaliza o block e os campos cmds da nota sem gravá-la e informa se algum campo mudou
+
+        Só os campos cujo conteúdo difere são atribuídos, então uma nota já normalizada
+        continua idêntica e não precisa ser gravada.
+        """
+        info = self.note_types.get(note.col, note.mid)
+        if info is None:
+            return False
+        changed, max_tag_num = core.normalize_fields(self.cache, info, note.fields)
+        if info.lacks_fields(max_tag_num):
+            # O campo é criado pela próxima passagem em lote, sem salvar o modelo aqui
+            self.dirty.mark(note.id)
+        return changed
 
     def update_cmds_fields(self, note, silent=False):
         """Atualiza os campos cmds baseado no número de tags encontradas"""
-        if not note or note.note_type()['name'] != self.note_type_name:
+        if not note or not self.note_types.is_closet(mw.col, note.mid):
             return False
 
         try:
-            block_content = note['block']
-            if not isinstance(block_content, str):
-                return False
-
-            # Reorganiza as tags c
-            block_content = self.reorganize_tags(block_content)
-
-            # Renomeia a tag mix para mix sem numeração se houver apenas uma
-            mix_tags = re.findall(r'\[\[mix(\d*)::', block_content)
-            if len(mix_tags) == 1:
-                block_content = re.sub(r'\[\[mix\d*::', r'[[mix::', block_content)
-
-            note['block'] = block_content
-
-            max_tag_num = self.count_tags(block_content)
-            self.ensure_fields_exist(note, max_tag_num)
-            changed = False
-
-            # Atualiza todos os campos cmds existentes até o maior número de tag encontrado
-            for i in range(1, max_tag_num + 1):
-                field_name = f'cmds{i}'
-                # Define como 'active'
-                if note[field_name] != 'active':
-                    note[field_name] = 'active'
-                    changed = True
-
-            # Desativa campos cmds que não devem estar ativos
-            for i in range(max_tag_num + 1, 100):  # Assume um limite de 100 campos cmds
-                field_name = f'cmds{i}'
-                if field_name in note and note[field_name] == 'active':
-                    note[field_name] = ''
-                    changed = True
-
-            if changed:
+            if self.normalize_note(note):
                 mw.col.update_note(note)
                 return True
+            perf_stats.increment("writes_avoided")
             return False
         except Exception as e:
-            if silent:
-                self.logger.error(f"Error updating fields: {str(e)}")
-            else:
+            self.logger.error(f"Error updating fields: {str(e)}")
+            if not silent:
                 showInfo(f"Error updating fields: {str(e)}")
             return False
 
+    def update_notes_in_background(self, note_ids=None, silent=False, provision=True):
+        """Atualiza as notas em segundo plano, gravando todas com uma única chamada update_notes e um único passo de desfazer
+
+        Sem note_ids, todas as notas Closet são lidas em blocos direto da tabela de notas;
+        objetos Note completos só são criados para as notas que precisam ser gravadas.
+        Se alguma nota não tiver campos cmds suficientes, nada é gravado: os campos são
+        criados na thread principal e a passagem roda de novo, gravando cada nota uma vez só.
+        """
+        if self._update_running:
+            if not silent:
+                tooltip(f"A {self.note_type_name} update is already running.")
+            return
+        mids = self.closet_mids()
+        note_ids = list(note_ids) if note_ids is not None else None
+        if note_ids is not None and not note_ids:
+            return
+        pass_kind = "full" if note_ids is None else "dirty"
+        cancelled = []
+        # Maior número de tag por modelo das notas sem campos cmds suficientes
+        missing_fields = {}
+        self._update_running = True
+
+        def op(col):
+            start = time.perf_counter()
+            notes = []
+            avoided = 0
+            # Blocks normalizados das notas gravadas, indexados depois da gravação
+            written_blocks = {}
+            seen_ids = set() if note_ids is None else None
+            total = scan.count_notes(col, self.note_types, note_ids)
+            scanned = 0
+            chunks = scan.iter_chunks(col, self.note_types, note_ids, self.SCAN_CHUNK_SIZE)
+            if self.parallel_rebuild and note_ids is None and self.parallel.should_run(total):
+                # Os blocks são normalizados em outros processos; aqui restam consultas ao cache e gravações
+                chunks = self.parallel.prewarm(chunks, self.cache)
+            for chunk in chunks:
+                if mw.progress.want_cancel():
+                    cancelled.append(True)
+                    perf_stats.record_pass(pass_kind, scanned, 0, time.perf_counter() - start, cancelled=True)
+                    return OpChangesWithCount()
+                mw.taskman.run_on_main(
+                    lambda scanned=scanned: mw.progress.update(
+                        label=f"Updating {self.note_type_name} notes... ({scanned}/{total})",
+                        value=scanned,
+                        max=total,
+                    )
+                )
+                scanned += len(chunk)
+                # O índice de tags é atualizado a cada bloco, para a memória não crescer com a coleção
+                index_mods = self.tag_index.mods(raw.id for raw in chunk)
+                index_blocks = {}
+                for raw in chunk:
+                    normalized, max_tag_num = self.cache.normalize(raw.block)
+                    if index_mods.get(raw.id) != raw.mod:
+                        index_blocks[raw.id] = normalized
+                    if seen_ids is not None:
+                        seen_ids.add(raw.id)
+                    if provision and self.note_types.get(col, raw.mid).lacks_fields(max_tag_num):
+                        missing_fields[raw.mid] = max(missing_fields.get(raw.mid, 0), max_tag_num)
+                    if missing_fields:
+                        # A passagem será refeita depois da criação dos campos; só falta achar o maior número de tag
+                        continue
+                    if not core.raw_needs_write(raw, normalized, max_tag_num):
+                        avoided += 1
+                        continue
+                    try:
+                        note = col.get_note(raw.id)
+                        if self.normalize_note(note):
+                            notes.append(note)
+                            # A gravação muda o mod da nota
+                            index_blocks.pop(raw.id, None)
+                            written_blocks[raw.id] = normalized
+                        else:
+                            avoided += 1
+                    except NotFoundError:
+                        continue  # A nota foi apagada durante a leitura
+                    except Exception as e:
+                        self.logger.error(f"Error updating fields of note {raw.id}: {str(e)}")
+                self.tag_index.update(col, index_blocks)
+            if missing_fields:
+                self.cache.flush()
+                return OpChangesWithCount()
+            changes = None
+            if notes:
+                # Sem notas a gravar, nenhum passo de desfazer vazio é criado
+                undo_entry = col.add_custom_undo_entry(self.UNDO_LABEL)
+                col.update_notes(notes)
+                changes = col.merge_undo_entries(undo_entry)
+            self.dirty.commit(col, mids, note_ids)
+            self.cache.flush()
+            # Depois da gravação, para o índice guardar o mod atual das notas
+            self.tag_index.update(col, written_blocks, keep_ids=seen_ids)
+            perf_stats.increment("writes_avoided", avoided)
+            perf_stats.record_pass(pass_kind, scanned, len(notes), time.perf_counter() - start)
+            if changes is None:
+                return OpChangesWithCount()
+            return OpChangesWithCount(changes=changes, count=len(notes))
+
+        def on_success(result):
+            self._update_running = False
+            if missing_fields and not cancelled:
+                # Mesmo se a criação dos campos for recusada, as notas são gravadas com os campos que existem
+                self.provision_fields(missing_fields)
+                self.update_notes_in_background(note_ids, silent=silent, provision=False)
+                return
+            if silent:
+                return
+            if cancelled:
+                tooltip(f"{self.note_type_name} update cancelled.")
+            else:
+                showInfo(f"All {self.note_type_name} notes have been updated ({result.count} changed).")
+
+        def on_failure(exc):
+            self._update_running = False
+            self.logger.error(f"Error updating {self.note_type_name} notes: {str(exc)}")
+            if not silent:
+                showInfo(f"Error updating {self.note_type_name} notes: {str(exc)}")
+
+        CollectionOp(parent=mw, op=op).success(on_success).failure(on_failure).with_progress(
+            f"Updating {self.note_type_name} notes..."
+        ).run_in_background()
+
     def update_all_notes(self, silent=False):
         """Atualiza todas as notas do tipo especificado"""
         try:
-            note_ids = mw.col.find_notes(f"note:{self.note_type_name}")
-            for note_id in note_ids:
-                note = mw.col.get_note(note_id)
-                self.update_cmds_fields(note, silent=silent)
-            if not silent:
-                showInfo(f"All {self.note_type_name} notes have been updated.")
+            self.update_notes_in_background(None, silent=silent)
         except Exception as e:
-            if silent:
-                self.logger.error(f"Error updating {self.note_type_name} notes: {str(e)}")
-            else:
+            self.logger.error(f"Error updating {self.note_type_name} notes: {str(e)}")
+            if not silent:
                 showInfo(f"Error updating {self.note_type_name} notes: {str(e)}")
 
+    def iter_dirty_flush(self):
+        """Tarefa ociosa: grava as notas adicionadas ou editadas desde a última passagem"""
+        while self._update_running:
+            yield idle_scheduler.WAIT
+        if not self.dirty.high_water_mark(mw.col):
+            # Primeira passagem nesta coleção: uma leitura completa em blocos
+            yield from self.iter_full_rescan()
+            return
+        note_ids = self.dirty.collect(mw.col, self.closet_mids())
+        yield
+        if note_ids:
+            self.update_notes_in_background(note_ids, silent=True)
+
+    def iter_full_rescan(self):
+        """Tarefa ociosa: lê todas as notas Closet em pequenos blocos, cedendo o controle entre eles
+
+        Só as notas que precisam mudar são entregues a uma passagem em segundo plano,
+        que as grava com um único passo de desfazer; as demais vão direto para o índice de tags,
+        um bloco por vez, e as entradas de notas que sumiram são removidas também aos poucos.
+        """
+        note_ids = []
+        seen_ids = set()
+        for chunk in scan.iter_chunks(mw.col, self.note_types, None, self.IDLE_CHUNK_SIZE):
+            index_mods = self.tag_index.mods(raw.id for raw in chunk)
+            index_blocks = {}
+            for raw in chunk:
+                normalized, max_tag_num = self.cache.normalize(raw.block)
+                seen_ids.add(raw.id)
+                if (self.note_types.get(mw.col, raw.mid).lacks_fields(max_tag_num)
+                        or core.raw_needs_write(raw, normalized, max_tag_num)):
+                    note_ids.append(raw.id)
+                else:
+                    perf_stats.increment("writes_avoided")
+                    if index_mods.get(raw.id) != raw.mod:
+                        index_blocks[raw.id] = normalized
+            # As notas a gravar são indexadas pela passagem que as grava
+            self.tag_index.update(mw.col, index_blocks)
+            yield
+        stale_ids = [note_id for note_id in self.tag_index.ids() if note_id not in seen_ids]
+        yield
+        for offset in range(0, len(stale_ids), self.tag_index.CHUNK_SIZE):
+            self.tag_index.remove(stale_ids[offset:offset + self.tag_index.CHUNK_SIZE])
+            yield
+        while self._update_running:
+            yield idle_scheduler.WAIT
+        if note_ids:
+            self.update_notes_in_background(note_ids, silent=True)
+        elif not self.dirty.high_water_mark(mw.col):
+            # Nada a gravar: só registra a marca, sem abrir uma operação
+            self.dirty.commit(mw.col, self.closet_mids(), [])
+
+    def iter_compact_cache(self):
+        """Tarefa ociosa: grava o cache de blocks e devolve ao disco, poucas páginas por vez, o espaço das entradas removidas"""
+        yield
+        self.cache.flush()
+        yield
+        while self.cache.compact_step(self.COMPACT_PAGES):
+            yield
+
+    def on_note_changed(self, note):
+        """Marca a nota adicionada ou editada para a próxima passagem"""
+        if note and note.id:
+            self.dirty.mark(note.id)
+
+    def on_profile_will_close(self):
+        """Grava o cache de blocks normalizados antes de fechar o perfil"""
+        self.cache.flush()
+
     def on_deck_browser(self, deck_browser, content):
-        """Busca por cartões do tipo especificado e aplica a função update_cmds_fields"""
-        self.update_all_notes(silent=True)
+        """Agenda a atualização das notas alteradas desde a última passagem para quando o Anki estiver ocioso"""
+        idle_scheduler.enqueue("dirty_flush", self.iter_dirty_flush)
 
     def on_review_card(self, reviewer_or_card):
         """Chamado durante a revisão do cartão"""
@@ -115,57 +324,116 @@ class ClosetNoteUpdater:
             if not card:
                 return
 
-            # Obtém a nota do cartão
-            note = card.note()
-            if note and note.note_type()['name'] == self.note_type_name:
-                self.update_cmds_fields(note, silent=True)
+            # Caminho rápido: a nota não mudou desde a última vez que foi processada
+            mod = mw.col.db.scalar("select mod from notes where id = ?", card.nid)
+            if mod is not None and self.review_stamps.get(card.nid) == mod:
+                return
+
+            # Nada é gravado durante a exibição: uma nota que precisa mudar fica para a passagem ociosa
+            for raw in scan.iter_raw_notes(mw.col, self.note_types, [card.nid]):
+                self.check_raw_note(mw.col, raw)
+                return
+            # Cartões de outros tipos de nota também vão para o caminho rápido
+            self.stamp_reviewed(card.nid, mod)
         except Exception as e:
             pass  # Silenciosamente ignora erros não críticos
+        finally:
+            # Normaliza os próximos cartões fora do caminho de renderização
+            mw.progress.single_shot(self.PREFETCH_DELAY_MS, self.prefetch_upcoming)
+
+    def check_raw_note(self, col, raw):
+        """Marca a nota para a próxima passagem se algum campo precisar mudar; senão a registra como processada
+
+        Informa se a nota já estava normalizada.
+        """
+        normalized, max_tag_num = self.cache.normalize(raw.block)
+        if (self.note_types.get(col, raw.mid).lacks_fields(max_tag_num)
+                or core.raw_needs_write(raw, normalized, max_tag_num)):
+            self.dirty.mark(raw.id)
+            return False
+        self.stamp_reviewed(raw.id, raw.mod)
+        return True
+
+    def stamp_reviewed(self, note_id, mod):
+        """Guarda o (id, mod) da nota já processada para que a próxima exibição a ignore"""
+        if len(self.review_stamps) >= self.MAX_REVIEW_STAMPS:
+            self.review_stamps.clear()
+        self.review_stamps[note_id] = mod
 
-    def test_update_cmds_fields(self):
-        """Função de teste para verificar se cmds1 está sendo ativado"""
-        note = mw.col.newNote()
-        note.note_type()['name'] = self.note_type_name
-        note['block'] = "To mix (shuffle) cards, there's a few ways to do it.\nMethod #1. To reorganize sentences:\n[[mix1::This is my first sentence]], and here is the rest of the first phrase.\n[[mix1::This is the second sentence]], and here is the last of this second phrase."
-        deck_id = mw.col.decks.id("Default")
-        mw.col.add_note(note, deck_id)
-        self.update_cmds_fields(note)
-        assert note['cmds1'] == 'active', "cmds1 should be active"
-
-    def init(self):
-        """Inicializa os hooks"""
+    def prefetch_upcoming(self):
+        """Confere em segundo plano as notas dos próximos cartões da fila de revisão
+
+        Nada é gravado aqui: uma gravação sem passo de desfazer limparia a fila de
+        desfazer do Anki, e o desfazer da resposta deixaria de existir. As notas já
+        normalizadas são marcadas para o caminho rápido da exibição; as demais ficam
+        para a próxima passagem das notas alteradas.
+        """
+        if self._prefetch_running or mw.state != "review" or not mw.col:
+            return
         try:
-            # Adiciona os hooks necessários
-            gui_hooks.reviewer_did_show_question.append(self.on_review_card)
-            gui_hooks.deck_browser_will_render_content.append(self.on_deck_browser)
-            # Adiciona o teste após a coleção estar carregada
-            gui_hooks.profile_did_open.append(lambda: mw.progress.single_shot(1000, self.test_update_cmds_fields))
+            queued = mw.col.sched.get_queued_cards(fetch_limit=self.PREFETCH_COUNT)
+            note_ids = {queued_card.card.note_id for queued_card in queued.cards}
+            mids = self.closet_mids()
+            if not note_ids or not mids:
+                return
+            rows = mw.col.db.all(
+                f"select id, mod from notes where id in {ids2str(note_ids)} and mid in {ids2str(mids)}"
+            )
+            pending = [note_id for note_id, mod in rows if self.review_stamps.get(note_id) != mod]
         except Exception as e:
-            showInfo(f"Error in init: {str(e)}")
+            self.logger.error(f"Error reading the review queue: {str(e)}")
+            return
+        if not pending:
+            return
+        self._prefetch_running = True
+
+        def op(col):
+            for raw in scan.iter_raw_notes(col, self.note_types, pending):
+                self.check_raw_note(col, raw)
+
+        def on_done(result):
+            self._prefetch_running = False
+
+        def on_failure(exc):
+            self._prefetch_running = False
+            self.logger.error(f"Error checking upcoming cards: {str(exc)}")
+
+        QueryOp(parent=mw, op=op, success=on_done).failure(on_failure).run_in_background()
+
+    def on_profile_did_open(self):
+        """Abre o índice de tags do perfil e agenda a compactação do cache, executada só quando o Anki estiver ocioso
+
+        Uma releitura completa só roda sob demanda, pelo menu Closet, ou na primeira passagem da coleção.
+        """
+        self.tag_index.open(mw.pm.name)
+        self.load_cache_in_background()
+        idle_scheduler.enqueue("compact_cache", self.iter_compact_cache)
+
+    def load_cache_in_background(self):
+        """Lê o cache de blocks do disco em segundo plano, antes que a revisão ou uma tarefa ociosa o consulte na thread principal"""
+        read_entries = self.cache.start_load()
+        if read_entries is None:
+            return
+
+        def on_failure(exc):
+            self.logger.error(f"Error loading block cache: {str(exc)}")
+
+        QueryOp(parent=mw, op=lambda col: read_entries(), success=lambda result: None).failure(
+            on_failure
+        ).run_in_background()
 
     def on_overview_will_render_content(self, overview, content):
-        """Busca por cartões do tipo especificado e aplica a função update_cmds_fields"""
-        self.update_all_notes(silent=True)
+        """Agenda a atualização das notas alteradas desde a última passagem para quando o Anki estiver ocioso"""
+        idle_scheduler.enqueue("dirty_flush", self.iter_dirty_flush)
 
     def on_addcards_did_change_note_type(self, addcards, old, new):
-        """Atualiza os campos cmds baseado no número de tags encontradas"""
-        if not new or new.note_type()['name'] != self.note_type_name:
+        """Atualiza em memória os campos cmds da nova nota, que ainda não foi adicionada"""
+        if not new or not self.note_types.is_closet(mw.col, new.mid):
             return False
-        self.update_cmds_fields(new, silent=True)
-
-    def on_editor_will_munge_html(self, txt, editor):
-        """
-        Hook chamado antes do Anki processar o HTML no editor.
-        Deve retornar o texto processado ou None para manter o texto original.
-        """
         try:
-            note = editor.note
-            if note and note.note_type()['name'] == self.note_type_name:
-                self.update_cmds_fields(note, silent=True)
-            return txt  # Retorna o texto original
+            self.normalize_note(new)
         except Exception as e:
-            self.logger.error(f"Error in on_editor_will_munge_html: {str(e)}")
-            return txt
+            self.logger.error(f"Error updating fields: {str(e)}")
 
 # Instancia o atualizador de notas Closet
 closet_note_updater = ClosetNoteUpdater()
@@ -0,0 +1,250 @@
+from typing import Dict, List, NamedTuple, Optional
+from aqt import mw
+from aqt.operations import CollectionOp, QueryOp
+from aqt.utils import askUser, showInfo, tooltip
+from anki.collection import OpChangesWithCount
+from anki.consts import MODEL_CLOZE
+from anki.errors import AbortSchemaModification
+from anki.utils import ids2str, split_fields
+import logging
+import time
+from . import tokenizer
+from .note_types import CMDS_FIELD, closet_note_types
+from .perf_stats import perf_stats
+
+class MigrationPlan(NamedTuple):
+    """What converting a set of notes would do, measured without writing anything"""
+    notes: int
+    type_changes: int
+    notes_changed: int
+    tags_converted: int
+    # note type name -> source fields with no place in the Closet note type
+    dropped_fields: Dict[str, List[str]]
+    elapsed: float
+    estimated: float
+    cancelled: bool = False
+    # note type name -> notes left as they are because the type is neither cloze nor Closet
+    skipped: Dict[str, int] = {}
+
+    def describe(self):
+        lines = [
+            f"{self.notes} notes selected.",
+            f"{self.type_changes} notes would change to the Closet note type.",
+            f"{self.notes_changed} notes would have {self.tags_converted} cloze tags converted.",
+        ]
+        for name, fields in self.dropped_fields.items():
+            lines.append(f"Fields of {name} that would be dropped: {', '.join(fields)}.")
+        if self.skipped:
+            skipped = ", ".join(f"{name} ({count})" for name, count in self.skipped.items())
+            lines.append(f"Notes left unchanged because their note type is not a cloze type: {skipped}.")
+        lines.append(f"Estimated time: {self.estimated:.1f} s.")
+        return "\n".join(lines)
+
+class ClozeMigration:
+    """Moves legacy cloze notes to the Closet note type in one undo step
+
+    The note type change, the field mapping, the conversion of {{cN::}} tags and
+    the cmds normalization all happen in a single background operation that reads
+    the notes in batches and writes them with one update_notes call. Only notes of
+    cloze note types, and Closet notes still holding {{cN::}} tags, are touched;
+    Basic, Image Occlusion and other notes in the scope are left as they are.
+    """
+
+    UNDO_LABEL = "Convert Cloze Notes to Closet"
+    BATCH_SIZE = 500
+    # Used for the estimate until an update pass has measured the real cost of a write
+    DEFAULT_WRITE_MS_PER_NOTE = 0.5
+
+    def __init__(self, updater):
+        self.updater = updater
+        self.logger = logging.getLogger(__name__)
+
+    def target_mid(self, col):
+        """Returns the id of the first configured Closet note type present in the collection"""
+        for name in closet_note_types.names:
+            model = col.models.by_name(name)
+            if model:
+                return model['id']
+        return None
+
+    def field_map(self, source, target) -> List[Optional[int]]:
+        """For each target field, the index of the source field it receives, or None
+
+        Fields with the same name are paired first, then the first remaining source
+        field goes to block and the others fill the remaining non-cmds fields in order.
+        """
+        source_names = [field['name'] for field in source['flds']]
+        target_names = [field['name'] for field in target['flds']]
+        lower_source = [name.lower() for name in source_names]
+        mapping = [
+            lower_source.index(name.lower()) if name.lower() in lower_source else None
+            for name in target_names
+        ]
+        remaining = [index for index in range(len(source_names)) if index not in mapping]
+        if 'block' in target_names and mapping[target_names.index('block')] is None and remaining:
+            mapping[target_names.index('block')] = remaining.pop(0)
+        for position, name in enumerate(target_names):
+            if mapping[position] is None and remaining and not CMDS_FIELD.match(name):
+                mapping[position] = remaining.pop(0)
+        return mapping
+
+    def is_convertible(self, col, mid):
+        """Tells whether notes of the given type are converted: cloze note types and the Closet types themselves"""
+        return closet_note_types.is_closet(col, mid) or col.models.get(mid)['type'] == MODEL_CLOZE
+
+    def block_source(self, col, mid, target_mid):
+        """Index of the field that becomes the block of a note of the given type"""
+        info = closet_note_types.get(col, mid)
+        if info is not None:
+            return info.block_index
+        target = col.models.get(target_mid)
+        block_index = [field['name'] for field in target['flds']].index('block')
+        return self.field_map(col.models.get(mid), target)[block_index]
+
+    def write_ms_per_note(self):
+        """Average cost of writing one note in the recorded update passes"""
+        passes = [entry for entry in perf_stats.history if entry.get("modified")]
+        if not passes:
+            return self.DEFAULT_WRITE_MS_PER_NOTE
+        return sum(entry["ms"] for entry in passes) / sum(entry["modified"] for entry in passes)
+
+    def plan(self, col, note_ids, target_mid):
+        """Reads the notes in batches and counts what the conversion would change"""
+        start = time.perf_counter()
+        note_ids = sorted(note_ids)
+        sources = {}
+        dropped_fields = {}
+        skipped = {}
+        type_changes = notes_changed = tags_converted = 0
+        for offset in range(0, len(note_ids), self.BATCH_SIZE):
+            if mw.progress.want_cancel():
+                return MigrationPlan(len(note_ids), type_changes, notes_changed, tags_converted,
+                                     dropped_fields, time.perf_counter() - start, 0.0, cancelled=True,
+                                     skipped=skipped)
+            mw.taskman.run_on_main(
+                lambda offset=offset: mw.progress.update(
+                    label=f"Checking notes... ({offset}/{len(note_ids)})", value=offset, max=len(note_ids)
+                )
+            )
+            batch = note_ids[offset:offset + self.BATCH_SIZE]
+            for note_id, mid, flds in col.db.all(f"select id, mid, flds from notes where id in {ids2str(batch)}"):
+                if mid not in sources and not self.is_convertible(col, mid):
+                    sources[mid] = False
+                if sources.get(mid) is False:
+                    name = col.models.get(mid)['name']
+                    skipped[name] = skipped.get(name, 0) + 1
+                    continue
+                if mid not in sources:
+                    sources[mid] = self.block_source(col, mid, target_mid)
+                    if not closet_note_types.is_closet(col, mid):
+                        source, target = col.models.get(mid), col.models.get(target_mid)
+                        mapped = set(self.field_map(source, target))
+                        dropped = [field['name'] for index, field in enumerate(source['flds']) if index not in mapped]
+                        if dropped:
+                            dropped_fields[source['name']] = dropped
+                if not closet_note_types.is_closet(col, mid):
+                    type_changes += 1
+                block_index = sources[mid]
+                if block_index is None:
+                    continue
+                block = split_fields(flds)[block_index]
+                converted = tokenizer.cloze_to_closet(block)
+                if converted != block:
+                    notes_changed += 1
+                    tags_converted += len(tokenizer.tokenize(converted)) - len(tokenizer.tokenize(block))
+        elapsed = time.perf_counter() - start
+        writes = max(type_changes, notes_changed)
+        # The conversion reads and converts every note again, then writes the changed ones
+        estimated = elapsed * 2 + writes * self.write_ms_per_note() / 1000
+        return MigrationPlan(len(note_ids), type_changes, notes_changed, tags_converted,
+                             dropped_fields, elapsed, estimated, skipped=skipped)
+
+    def change_notetype(self, col, note_ids, old_mid, new_mid):
+        """Moves the notes to the Closet note type with the add-on's field mapping"""
+        request = col.models.change_notetype_info(old_notetype_id=old_mid, new_notetype_id=new_mid).input
+        request.note_ids.extend(note_ids)
+        mapping = self.field_map(col.models.get(old_mid), col.models.get(new_mid))
+        del request.new_fields[:]
+        request.new_fields.extend(-1 if index is None else index for index in mapping)
+        col.models.change_notetype_of_notes(request)
+
+    def apply(self, col, note_ids, target_mid):
+        """Converts the notes and writes them all at once in a single undo step"""
+        start = time.perf_counter()
+        undo_entry = col.add_custom_undo_entry(self.UNDO_LABEL)
+        by_mid = {}
+        for note_id, mid in col.db.all(f"select id, mid from notes where id in {ids2str(note_ids)}"):
+            if self.is_convertible(col, mid):
+                by_mid.setdefault(mid, []).append(note_id)
+        note_ids = sorted(note_id for ids in by_mid.values() for note_id in ids)
+        for mid, ids in by_mid.items():
+            if not closet_note_types.is_closet(col, mid):
+                self.change_notetype(col, ids, mid, target_mid)
+        closet_note_types.invalidate()
+
+        notes = []
+        for offset in range(0, len(note_ids), self.BATCH_SIZE):
+            mw.taskman.run_on_main(
+                lambda offset=offset: mw.progress.update(
+                    label=f"Converting notes... ({offset}/{len(note_ids)})", value=offset, max=len(note_ids)
+                )
+            )
+            for note_id in note_ids[offset:offset + self.BATCH_SIZE]:
+                note = col.get_note(note_id)
+                info = closet_note_types.get(col, note.mid)
+                if info is None or info.block_index is None:
+                    continue
+                block = note.fields[info.block_index]
+                converted = tokenizer.cloze_to_closet(block)
+                if converted != block:
+                    note.fields[info.block_index] = converted
+                if self.updater.normalize_note(note) or converted != block:
+                    notes.append(note)
+        col.update_notes(notes)
+        changes = col.merge_undo_entries(undo_entry)
+        perf_stats.record_pass("cloze_migration", len(note_ids), len(notes), time.perf_counter() - start)
+        return OpChangesWithCount(changes=changes, count=len(notes))
+
+    def run(self, parent, note_ids, dry_run=False):
+        """Checks the notes in the background, then reports (dry run) or asks and converts them"""
+        note_ids = list(note_ids)
+        target_mid = self.target_mid(mw.col)
+        if target_mid is None:
+            showInfo(f"No Closet note type ({', '.join(closet_note_types.names)}) was found.")
+            return
+        if not note_ids:
+            tooltip("No notes to convert.")
+            return
+
+        def on_planned(plan):
+            if plan.cancelled:
+                tooltip("Conversion cancelled.")
+            elif dry_run:
+                showInfo(f"Dry run, nothing was changed.\n\n{plan.describe()}", parent=parent)
+            elif not plan.type_changes and not plan.notes_changed:
+                showInfo(f"Nothing to convert.\n\n{plan.describe()}", parent=parent)
+            elif askUser(f"{plan.describe()}\n\nConvert these notes?", parent=parent):
+                self.convert(parent, note_ids, target_mid, plan)
+
+        QueryOp(parent=parent, op=lambda col: self.plan(col, note_ids, target_mid), success=on_planned).failure(
+            self.on_failure
+        ).with_progress("Checking notes...").run_in_background()
+
+    def convert(self, parent, note_ids, target_mid, plan):
+        if plan.type_changes:
+            try:
+                # Changing the note type is a schema change: ask about the full sync on the main thread
+                mw.col.mod_schema(check=True)
+            except AbortSchemaModification:
+                return
+
+        def on_success(result):
+            showInfo(f"{result.count} notes were converted to Closet.", parent=parent)
+
+        CollectionOp(parent=parent, op=lambda col: self.apply(col, note_ids, target_mid)).success(
+            on_success
+        ).failure(self.on_failure).with_progress("Converting notes...").run_in_background()
+
+    def on_failure(self, exc):
+        self.logger.error(f"Error converting cloze notes: {str(exc)}")
+        showInfo(f"Error converting cloze notes: {str(exc)}")
@@ -0,0 +1,30 @@
+import json
+import os
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
+
+DEFAULT_CONFIG = {
+    "note_types": ["Closet-r"],
+    "closet_color": "Blue",
+    "highlight_all_cloze": False,
+    "show_deck_name": True,
+    "theme_mode": "template",
+    "cmds_field_headroom": 0,
+    "block_cache_size": 50000,
+    "parallel_rebuild": False,
+    "parallel_workers": 0,
+    "parallel_min_notes": 20000,
+}
+
+def load_config():
+    """Loads the configuration from the file, filling in defaults for missing keys"""
+    config = dict(DEFAULT_CONFIG)
+    if os.path.exists(CONFIG_PATH):
+        with open(CONFIG_PATH, "r") as f:
+            config.update(json.load(f))
+    return config
+
+def save_config(config):
+    """Saves the configuration to the file"""
+    with open(CONFIG_PATH, "w") as f:
+        json.dump(config, f)
@@ -2,11 +2,15 @@
 from aqt import mw
 from aqt.utils import showInfo
 from aqt import gui_hooks
-import json
-import os
+from aqt.qt import QAction
+from anki.collection import SearchNode
 import re
 import logging
-from .view import ClosetConfigDialog, ClosetMenu
+from .config import load_config, save_config
+from .hook_registry import hook_registry
+from .note_types import closet_note_types
+from .perf_stats import perf_stats
+from .view import ClosetConfigDialog, ClosetMenu, ClozeMigrationDialog, PerformanceDialog, TagSummaryDialog
 
 class ClosetController:
     COLOR_MAP = {
@@ -21,67 +25,68 @@ class ClosetController:
     def __init__(self, note_type_name='Closet-r'):
         self.note_type_name = note_type_name
         self.logger = logging.getLogger(__name__)
-        self.config_path = os.path.join(mw.pm.addonFolder(), "closet_note_type_reloaded", "config.json")
+        self.performance_dialog = None
+        self.runtime_style = None
         self.setup()
 
     def setup(self):
         self.menu = ClosetMenu(
             on_update_cards=lambda: self.update_all_notes(silent=False),
-            on_open_settings=self.open_config_dialog
+            on_open_settings=self.open_config_dialog,
+            on_open_performance=self.open_performance_dialog,
+            on_open_tag_summary=self.open_tag_summary,
+            on_convert_runtime=self.convert_runtime
         )
         self.menu.setup_menu()
+        self._update_runtime_style(self.load_config())
+        hook_registry.register(gui_hooks.card_will_show, self.on_card_will_show)
+        hook_registry.register(gui_hooks.browser_menus_did_init, self.on_browser_menus_did_init)
 
     def load_config(self):
         """Loads the configuration from the file"""
-        if os.path.exists(self.config_path):
-            with open(self.config_path, "r") as f:
-                return json.load(f)
-        return {
-            "closet_color": "Blue",
-            "highlight_all_cloze": False,
-            "show_deck_name": True
-        }
+        return load_config()
 
     def save_config(self, config):
         """Saves the configuration to the file"""
-        with open(self.config_path, "w") as f:
-            json.dump(config, f)
+        save_config(config)
 
     def apply_css(self, color_name, highlight_all_cloze, show_deck_name):
         """Applies the selected color to the CSS and configures the visibility of the deck name"""
         color = self.COLOR_MAP.get(color_name, "#3f8cf1")
-        model = mw.col.models.by_name(self.note_type_name)
-
-        # Remove existing closet-tag-color style
-        for template in model['tmpls']:
-            for field in ['qfmt', 'afmt']:
-                if field in template:
-                    template[field] = re.sub(
-                        r'<style id="closet-tag-color">.*?</style>',
-                        '',
-                        template[field],
-                        flags=re.DOTALL
-                    )
 
         # Create new style based on settings
         new_style = self._generate_style(color, highlight_all_cloze)
 
-        # Apply new style
-        for template in model['tmpls']:
-            for field in ['qfmt', 'afmt']:
-                if field in template:
-                    template[field] = template[field] + "\n" + new_style
+        for mid in closet_note_types.mids(mw.col):
+            model = mw.col.models.get(mid)
+
+            # Remove existing closet-tag-color style
+            for template in model['tmpls']:
+                for field in ['qfmt', 'afmt']:
+                    if field in template:
+                        template[field] = re.sub(
+                            r'<style id="closet-tag-color">.*?</style>',
+                            '',
+                            template[field],
+                            flags=re.DOTALL
+                        )
+
+            # Apply new style
+            for template in model['tmpls']:
+                for field in ['qfmt', 'afmt']:
+                    if field in template:
+                        template[field] = template[field] + "\n" + new_style
 
-        # Update deck name visibility
-        self._update_deck_name_visibility(model, show_deck_name)
+            # Update deck name visibility
+            self._update_deck_name_visibility(model, show_deck_name)
 
-        # Save changes and update hooks
-        mw.col.models.save(model)
-        self._update_hooks()
+            # Save changes
+            mw.col.models.save(model)
+            perf_stats.increment("model_saves")
 
-    def _generate_style(self, color, highlight_all_cloze):
+    def _generate_style(self, color, highlight_all_cloze, style_id="closet-tag-color"):
         if highlight_all_cloze:
-            return f"""<style id="closet-tag-color">
+            return f"""<style id="{style_id}">
     .closet-cloze.is-active.is-front,
     .cl--obscure,
     .closet-cloze.is-inactive .closet-cloze__answer,
@@ -89,7 +94,7 @@ class ClosetController:
         color: {color} !important;
     }}</style>"""
         else:
-            return f"""<style id="closet-tag-color">
+            return f"""<style id="{style_id}">
     .closet-cloze.is-active,
     .cl--obscure {{
         color: {color} !important;
@@ -99,6 +104,62 @@ class ClosetController:
         color: var(--text-color);
     }}</style>"""
 
+    def _generate_runtime_theme(self, highlight_all_cloze):
+        """Builds the cloze colors of the runtime theme
+
+        A Closet note type may still hold the closet-tag-color style last saved in
+        template mode, with !important rules. Every selector of both template styles
+        is therefore set here with !important under #qa, which outranks them.
+        """
+        closet_color = "var(--closet-color) !important"
+        text_color = "var(--text-color) !important"
+        colors = {
+            ".closet-cloze.is-active": "inherit !important" if highlight_all_cloze else closet_color,
+            ".closet-cloze.is-active.is-front": closet_color,
+            ".cl--obscure": closet_color,
+            ".closet-cloze.is-inactive .closet-cloze__answer": closet_color if highlight_all_cloze else text_color,
+            ".closet-cloze__answer": closet_color if highlight_all_cloze else text_color,
+        }
+        rules = "\n".join(
+            f"    #qa {selector} {{\n        color: {color};\n    }}" for selector, color in colors.items()
+        )
+        return f"""<style id="closet-runtime-theme">
+{rules}</style>"""
+
+    def _generate_runtime_style(self, color, highlight_all_cloze, show_deck_name):
+        """Builds the style injected into each Closet card at render time, driven by CSS variables"""
+        variables = f"""<style id="closet-runtime-variables">
+    :root {{
+        --closet-color: {color};
+        --closet-deck-name-opacity: {"1" if show_deck_name else "0"};
+    }}
+    .deck-name {{
+        opacity: var(--closet-deck-name-opacity) !important;
+        transition: opacity 0.3s ease;
+    }}</style>"""
+        return variables + self._generate_runtime_theme(highlight_all_cloze)
+
+    def _update_runtime_style(self, config):
+        if config.get("theme_mode") != "runtime":
+            self.runtime_style = None
+            return
+        self.runtime_style = self._generate_runtime_style(
+            self.COLOR_MAP.get(config["closet_color"], "#3f8cf1"),
+            config["highlight_all_cloze"],
+            config["show_deck_name"]
+        )
+
+    def on_card_will_show(self, text, card, kind):
+        """Appends the runtime theme to Closet cards; note types are never modified in this mode"""
+        if self.runtime_style is None:
+            return text
+        try:
+            if closet_note_types.is_closet(mw.col, card.note().mid):
+                return text + self.runtime_style
+        except Exception as e:
+            self.logger.error(f"Error applying the runtime theme: {str(e)}")
+        return text
+
     def _update_deck_name_visibility(self, model, show_deck_name):
         deck_name_css = f"""
         .deck-name {{
@@ -113,10 +174,6 @@ class ClosetController:
         else:
             model['css'] += f"\n{deck_name_css}"
 
-    def _update_hooks(self):
-        from .closet_note_updater import closet_note_updater
-        gui_hooks.reviewer_did_show_question.append(closet_note_updater.on_review_card)
-
     def open_config_dialog(self):
         """Opens the configuration dialog"""
         try:
@@ -132,21 +189,91 @@ class ClosetController:
         except Exception as e:
             showInfo(f"Error opening config dialog: {str(e)}")
 
+    def open_performance_dialog(self):
+        """Opens the performance panel, reusing it if it is already open"""
+        try:
+            if self.performance_dialog is None:
+                self.performance_dialog = PerformanceDialog(parent=mw, stats=perf_stats)
+                self.performance_dialog.finished.connect(self._on_performance_dialog_closed)
+            self.performance_dialog.show()
+            self.performance_dialog.raise_()
+        except Exception as e:
+            showInfo(f"Error opening performance panel: {str(e)}")
+
+    def open_tag_summary(self):
+        """Shows the distribution of Closet tags read from the tag index"""
+        from .closet_note_updater import closet_note_updater
+        try:
+            TagSummaryDialog(parent=mw, summary=closet_note_updater.tag_index.summary()).exec()
+        except Exception as e:
+            showInfo(f"Error opening tag summary: {str(e)}")
+
+    def _on_performance_dialog_closed(self, result):
+        self.performance_dialog = None
+
     def _handle_config_save(self, new_config):
-        self.save_config(new_config)
-        self.apply_css(
-            new_config["closet_color"],
-            new_config["highlight_all_cloze"],
-            new_config["show_deck_name"]
-        )
+        config = self.load_config()
+        config.update(new_config)
+        self.save_config(config)
+        self._update_runtime_style(config)
+        if config.get("theme_mode") != "runtime":
+            self.apply_css(
+                new_config["closet_color"],
+                new_config["highlight_all_cloze"],
+                new_config["show_deck_name"]
+            )
 
         # Refresh current card if in review
         if mw.reviewer and mw.reviewer.card:
             mw.reviewer.show()
 
     def update_all_notes(self, silent=False):
-        """Updates all notes (implementation needed)"""
-        pass  # Implement the update_all_notes functionality here
+        """Runs a full rescan of every Closet note"""
+        from .closet_note_updater import closet_note_updater
+        closet_note_updater.update_all_notes(silent=silent)
+
+    def on_browser_menus_did_init(self, browser):
+        """Adds the bulk Cloze to Closet conversion to the Browser's Notes menu"""
+        action = QAction("Convert Cloze Notes to Closet...", browser)
+        action.triggered.connect(lambda: self.open_cloze_migration(browser))
+        browser.form.menu_Notes.addAction(action)
+
+    def open_cloze_migration(self, browser):
+        """Opens the dialog that picks the selected notes or a deck and the dry-run mode"""
+        try:
+            dialog = ClozeMigrationDialog(
+                parent=browser,
+                selected_count=len(browser.selected_notes()),
+                deck_names=[deck.name for deck in mw.col.decks.all_names_and_ids()],
+                on_run=lambda deck_name, dry_run: self._run_cloze_migration(browser, deck_name, dry_run)
+            )
+            dialog.exec()
+        except Exception as e:
+            showInfo(f"Error opening cloze conversion: {str(e)}")
+
+    def _run_cloze_migration(self, browser, deck_name, dry_run):
+        from .closet_note_updater import closet_note_updater
+        from .cloze_migration import ClozeMigration
+        if deck_name is None:
+            note_ids = browser.selected_notes()
+        else:
+            note_ids = mw.col.find_notes(mw.col.build_search_string(SearchNode(deck=deck_name)))
+        ClozeMigration(closet_note_updater).run(browser, note_ids, dry_run=dry_run)
+
+    def convert_runtime(self, externalize):
+        """Moves the Closet script of the note types to the media folder, or back inline"""
+        from .runtime import closet_runtime
+        try:
+            closet_runtime.run(externalize)
+        except Exception as e:
+            showInfo(f"Error converting the Closet runtime: {str(e)}")
+
+# Created by init_controller once the profile opens
+closet_controller = None
 
-# Initialize the controller
-closet_controller = ClosetController()
\ No newline at end of file
+def init_controller():
+    """Creates the controller and its menu once"""
+    global closet_controller
+    if closet_controller is None:
+        closet_controller = ClosetController()
+    return closet_controller
\ No newline at end of file
@@ -0,0 +1,39 @@
+from typing import List, Tuple
+from .note_types import NoteTypeInfo
+
+# Normalization of Closet notes without aqt: shared by the add-on and the command-line processor in cli.py
+
+def normalize_fields(cache, info: NoteTypeInfo, fields: List[str]) -> Tuple[bool, int]:
+    """Normalizes the block and the cmds fields in place; returns whether a field changed and the highest tag
+
+    Only fields whose content differs are assigned, so an already normalized note
+    stays identical and does not need to be written.
+    """
+    if info.block_index is None or not isinstance(fields[info.block_index], str):
+        return False, 0
+    block_content = fields[info.block_index]
+    normalized, max_tag_num = cache.normalize(block_content)
+    changed = normalized != block_content
+    if changed:
+        fields[info.block_index] = normalized
+
+    for number, index in info.cmds.items():
+        if number <= max_tag_num:
+            # Activates the cmds fields up to the highest tag number found
+            if fields[index] != 'active':
+                fields[index] = 'active'
+                changed = True
+        elif fields[index] == 'active':
+            fields[index] = ''
+            changed = True
+
+    return changed, max_tag_num
+
+def raw_needs_write(raw, normalized, max_tag_num) -> bool:
+    """Tells from the fields read from the database whether the block or any cmds field has to change"""
+    if normalized != raw.block:
+        return True
+    for number, value in raw.cmds.items():
+        if (value != 'active') if number <= max_tag_num else (value == 'active'):
+            return True
+    return False
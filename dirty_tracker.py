@@ -0,0 +1,51 @@
+from anki.utils import ids2str
+import logging
+import time
+
+class DirtyNoteTracker:
+    """Keeps track of the Closet notes that changed since the last update pass"""
+
+    CONFIG_KEY = "closet_note_type_reloaded_high_water_mark"
+
+    def __init__(self):
+        self.pending = set()
+        self.logger = logging.getLogger(__name__)
+
+    def mark(self, note_id):
+        """Marks a note as changed so the next pass picks it up"""
+        if note_id:
+            self.pending.add(note_id)
+
+    def high_water_mark(self, col):
+        """Returns the highest note mod time processed by the last pass"""
+        return col.get_config(self.CONFIG_KEY, 0)
+
+    def collect(self, col, mids):
+        """Returns the ids of the notes added or edited since the last pass"""
+        note_ids = set(self.pending)
+        if mids:
+            note_ids.update(col.db.list(
+                f"select id from notes where mid in {ids2str(mids)} and mod > ?",
+                self.high_water_mark(col)
+            ))
+        return note_ids
+
+    def commit(self, col, mids, note_ids):
+        """Records that the given notes, or all notes when None, were processed and advances the high-water mark
+
+        Without Closet notes the mark becomes the current time, so it is never left at 0,
+        which would make every later pass a first, full one.
+        """
+        if note_ids is None:
+            self.pending.clear()
+        else:
+            self.pending.difference_update(note_ids)
+        high_water_mark = col.db.scalar(
+            f"select max(mod) from notes where mid in {ids2str(mids)}"
+        ) if mids else None
+        if high_water_mark is None:
+            if self.high_water_mark(col):
+                return
+            high_water_mark = int(time.time())
+        if high_water_mark != self.high_water_mark(col):
+            col.set_config(self.CONFIG_KEY, high_water_mark)
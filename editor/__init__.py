@@ -2,6 +2,7 @@ from aqt import gui_hooks
 from aqt.editor import Editor
 from aqt.qt import QShortcut, QKeySequence
 
+from ..hook_registry import hook_registry
 from .buttons import ClosetEditorChanges  # Import the class, not the instance
 from .hide_fields import init_cmd_fields_hiding
 
@@ -16,11 +17,11 @@ def setup_editor_shortcuts():
         shortcut.activated.connect(lambda: editor_changes.handle_closet_shortcut(editor))
 
     # Add the hook for setting up the shortcut when the editor is created
-    gui_hooks.editor_did_init.append(add_closet_shortcut)
+    hook_registry.register(gui_hooks.editor_did_init, add_closet_shortcut)
 
-    # Register the buttons
-    gui_hooks.editor_did_init_buttons.append(editor_changes.setup_closet_button)
-    gui_hooks.editor_did_init_buttons.append(editor_changes.setup_close_to_closet)
+    # Register the buttons, unless init_editor already did
+    hook_registry.register(gui_hooks.editor_did_init_buttons, editor_changes.setup_closet_button)
+    hook_registry.register(gui_hooks.editor_did_init_buttons, editor_changes.setup_close_to_closet)
 
     cmd_fields_handler = init_cmd_fields_hiding()
 
@@ -1,15 +1,30 @@
 from typing import Optional
 from aqt.editor import Editor
 from aqt.qt import QAction
-import re
 import logging
 import json
+from aqt import mw
+from ..note_types import closet_note_types
+from ..tokenizer import cloze_to_closet
 
 class ClosetEditorChanges:
+    SCRIPT = "web/closet_editor.js"
+
     def __init__(self, note_type_name='Closet-r'):
         self.note_type_name = note_type_name
         self.logger = logging.getLogger(__name__)
 
+    def on_webview_will_set_content(self, web_content, context):
+        """Adds the Closet editor script to every editor webview"""
+        if isinstance(context, Editor):
+            addon_package = mw.addonManager.addonFromModule(__name__)
+            web_content.js.append(f"/_addons/{addon_package}/{self.SCRIPT}")
+
+    def on_editor_will_load_note(self, js: str, note, editor: Editor) -> str:
+        """Tells the script whether the loaded note is a Closet note, as part of the load itself"""
+        enabled = closet_note_types.is_closet(mw.col, note.mid)
+        return js + f"; window.ClosetEditor && ClosetEditor.setEnabled({json.dumps(enabled)});"
+
     def setup_closet_button(self, buttons, editor: Editor):
         """Setup the closet tag button"""
         if button := self.generate_button(editor):
@@ -39,85 +54,68 @@ class ClosetEditorChanges:
             func=lambda e=editor: self.handle_closet_shortcut(e),  # Callback
             tip="Insert tag Closet (Ctrl+Shift+C)",  # Tooltip
             label="CL",  # Button label
-            keys="Ctrl+Shift+C",  # Shortcut keys
+            keys=None,  # Ctrl+Shift+C is handled inside the webview by closet_editor.js
         )
 
-    @staticmethod
-    def converter_chaves(texto: str) -> str:
-        """Convert cloze tags from {{c#}} to [[c#]]"""
-        # Match {{c#::text}} pattern
-        padrao = r'\{\{c(\d+)::(.*?)\}\}'
-        return re.sub(padrao, r'[[c\1::\2]]', texto)
-
     def handle_convert_close_to_closet(self, editor: Editor):
         """Handle the conversion from Close to Closet tags"""
-        if not editor.note or editor.note.note_type()['name'] != self.note_type_name:
+        if not editor.note or not closet_note_types.is_closet(mw.col, editor.note.mid):
+            return
+        field_index = editor.currentField
+        if field_index is None:
             return
 
-        try:
-            # Get the current field content
-            field_index = editor.currentField
-
-            # Select all content in the current field
-            editor.web.eval("saveSelection();")
-            editor.web.eval(f"""
-                document.getElementsByClassName('field')[{field_index}].focus();
-                document.execCommand('selectAll', false, null);
-            """)
+        # Convert what the webview holds, including typing not yet sent to Python
+        editor.call_after_note_saved(lambda: self.convert_field(editor, field_index), keepFocus=True)
 
-            # Get the selected content
+    def convert_field(self, editor: Editor, field_index: int):
+        """Converts one field and patches only that field in the webview, without reloading the note"""
+        try:
+            if not editor.note:
+                return
             field_content = editor.note.fields[field_index]
+            converted_content = cloze_to_closet(field_content)
+            if converted_content == field_content:
+                return
 
-            # Convert the content
-            converted_content = self.converter_chaves(field_content)
-
-            # Replace the field content
-            editor.web.eval(f"document.execCommand('insertText', false, {json.dumps(converted_content)});")
-
-            # Restore the original selection
-            editor.web.eval("restoreSelection();")
-
-            # Update the note
             editor.note.fields[field_index] = converted_content
-            editor.loadNote()
-
+            # The input event it fires makes the editor save the field as if it had been typed
+            editor.web.eval(
+                f"ClosetEditor.setFieldHtml({field_index}, {json.dumps(converted_content)});"
+            )
         except Exception as e:
             self.logger.error(f"Error converting Close to Closet: {str(e)}")
 
     def handle_closet_shortcut(self, editor: Editor):
-        """Handle the closet shortcut"""
-        if not editor.note or editor.note.note_type()['name'] != self.note_type_name:
+        """Handle the closet button: the webview wraps the selection with the next number across all fields"""
+        if not editor.note or not closet_note_types.is_closet(mw.col, editor.note.mid):
             return
 
         try:
-            selected_text = editor.web.selectedText()
-            if not selected_text:
-                return
-
-            trimmed_text = selected_text.strip()
-            field_content = editor.note.fields[editor.currentField]
-
-            existing_numbers = re.findall(r'\[\[c(\d+)::', field_content)
-            next_num = max(map(int, existing_numbers or [0])) + 1
-
-            replacement = f"[[c{next_num}::{trimmed_text}]]"
-
-            editor.web.eval(
-                f"document.execCommand('insertText', false, {json.dumps(replacement + ' ')});"
-            )
+            editor.web.eval("ClosetEditor.wrapSelection();")
         except Exception as e:
             self.logger.error(f"Error handling closet shortcut: {str(e)}")
 
+# Created by init_editor once the profile opens
+closet_editor_changes = None
+
 def init_editor():
-    """Initialize the editor changes"""
+    """Initialize the editor changes once"""
+    global closet_editor_changes
+    if closet_editor_changes is not None:
+        return closet_editor_changes
     editor_changes = ClosetEditorChanges()
 
     # Register both buttons with the editor
     from aqt.gui_hooks import editor_did_init_buttons
-    editor_did_init_buttons.append(editor_changes.setup_closet_button)
-    editor_did_init_buttons.append(editor_changes.setup_close_to_closet)
+    from ..hook_registry import hook_registry
+    hook_registry.register(editor_did_init_buttons, editor_changes.setup_closet_button)
+    hook_registry.register(editor_did_init_buttons, editor_changes.setup_close_to_closet)
 
-    return editor_changes
+    # Closet tag insertion script
+    from aqt.gui_hooks import editor_will_load_note, webview_will_set_content
+    hook_registry.register(webview_will_set_content, editor_changes.on_webview_will_set_content)
+    hook_registry.register(editor_will_load_note, editor_changes.on_editor_will_load_note)
 
-# Create the instance
-closet_editor_changes = init_editor()
\ No newline at end of file
+    closet_editor_changes = editor_changes
+    return editor_changes
\ No newline at end of file
@@ -1,80 +1,92 @@
-from typing import Optional
 from aqt.editor import Editor
-from aqt.qt import QAction
 from aqt import gui_hooks
+from aqt import mw
+import json
 import logging
+import time
+import weakref
+from ..hook_registry import hook_registry
+from ..note_types import closet_note_types
+from ..perf_stats import perf_stats
 
 class HideCmdFields:
-    def __init__(self, note_type_name='Closet-r', num_fields_to_hide=10):
+    STYLE_ID = "closet-hide-cmds"
+
+    def __init__(self, note_type_name='Closet-r'):
         self.note_type_name = note_type_name
-        self.num_fields_to_hide = num_fields_to_hide
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG)
+        # Stylesheet currently injected in each editor webview, so unchanged layouts cost no eval
+        self.injected = weakref.WeakKeyDictionary()
+        self.load_started = weakref.WeakKeyDictionary()
+
+    def hidden_field_indices(self, note):
+        """Returns the positions of the cmdsN fields of the note's type"""
+        info = closet_note_types.get(mw.col, note.mid)
+        return sorted(info.cmds.values()) if info else []
+
+    def stylesheet(self, note):
+        """Builds the CSS that hides the cmdsN fields, or an empty one for other note types"""
+        selectors = ",\n".join(
+            f".fields > :nth-child({index + 1})" for index in self.hidden_field_indices(note)
+        )
+        return f"{selectors} {{ display: none !important; }}" if selectors else ""
 
     def setup_editor_fields(self, editor: Editor):
-        """Hide the last N fields in the editor"""
+        """Hide the cmdsN fields in the editor through a single stylesheet per webview"""
         try:
             if not editor.note:
                 self.logger.debug("No note loaded in editor")
                 return
 
-            note_type = editor.note.note_type()
-            if not note_type or note_type['name'] != self.note_type_name:
-                self.logger.debug(f"Note type mismatch: expected {self.note_type_name}")
+            css = self.stylesheet(editor.note)
+            if self.injected.get(editor) == css:
                 return
 
-            # Script to hide the last N fields
+            # The style element survives note loads, so only its text changes afterwards
             script = f"""
-            function hideLastFields() {{
-                try {{
-                    // Get all field containers
-                    const fields = document.querySelectorAll('.fields')[0].children;
-                    const totalFields = fields.length;
-
-                    // Calculate start index for hiding
-                    const startHideIndex = totalFields - {self.num_fields_to_hide};
-
-                    // Hide the last N fields
-                    for (let index = 2; index < totalFields - 2; index++) {{
-                        fields[index].style.display = 'none';
-                    }};
-
-                }} catch (error) {{
-                    console.error('Error in hideLastFields:', error);
-                }}
-            }}
-
-            // Initial execution
-            hideLastFields();
-            // Set up observer to maintain hiding after dynamic updates
-            const observer = new MutationObserver((mutations) => {{
-                for (const mutation of mutations) {{
-                    if (mutation.type === 'childList') {{
-                        hideLastFields();
-                    }}
+            (function (css) {{
+                let style = document.getElementById({json.dumps(self.STYLE_ID)});
+                if (!style) {{
+                    style = document.createElement('style');
+                    style.id = {json.dumps(self.STYLE_ID)};
+                    document.head.appendChild(style);
                 }}
-            }});
-
-            observer.observe(document.body, {{
-                childList: true,
-                subtree: true
-            }});
+                style.textContent = css;
+            }})({json.dumps(css)});
             """
 
             editor.web.eval(script)
-            self.logger.info(f"Successfully hidden last {self.num_fields_to_hide} fields")
+            self.injected[editor] = css
+            self.logger.info(f"Hiding {css.count('nth-child')} cmds fields")
 
         except Exception as e:
-            self.logger.error(f"Error hiding last fields: {str(e)}")
+            self.logger.error(f"Error hiding cmds fields: {str(e)}")
+
+    def on_editor_did_init(self, editor: Editor):
+        """A new editor starts with a fresh webview, without the stylesheet"""
+        self.injected.pop(editor, None)
+
+    def on_editor_will_load_note(self, js: str, note, editor: Editor) -> str:
+        """Starts timing the note load, reported to the performance panel"""
+        self.load_started[editor] = time.perf_counter()
+        return js
+
+    def on_editor_did_load_note(self, editor: Editor):
+        started = self.load_started.pop(editor, None)
+        if started is not None:
+            perf_stats.record_timing("editor_load", time.perf_counter() - started)
+        self.setup_editor_fields(editor)
 
     def init_hide_fields(self):
         """Initialize hooks for field hiding"""
         try:
             # Hook for editor initialization
-            gui_hooks.editor_did_init.append(lambda editor: self.setup_editor_fields(editor))
+            hook_registry.register(gui_hooks.editor_did_init, self.on_editor_did_init)
 
-            # Hook for note loading
-            gui_hooks.editor_did_load_note.append(self.setup_editor_fields)
+            # Hooks for note loading
+            hook_registry.register(gui_hooks.editor_will_load_note, self.on_editor_will_load_note)
+            hook_registry.register(gui_hooks.editor_did_load_note, self.on_editor_did_load_note)
 
             self.logger.info("Successfully initialized field hiding hooks")
 
@@ -82,15 +94,19 @@ class HideCmdFields:
             self.logger.error(f"Failed to initialize field hiding: {str(e)}")
             raise
 
+# Created by init_cmd_fields_hiding once the profile opens
+cmd_fields_handler = None
+
 def init_cmd_fields_hiding():
-    """Main initialization function"""
+    """Main initialization function; creates the handler and registers its hooks once"""
+    global cmd_fields_handler
+    if cmd_fields_handler is not None:
+        return cmd_fields_handler
     try:
-        hide_fields = HideCmdFields(num_fields_to_hide=10)  # Hide last 10 fields
+        hide_fields = HideCmdFields()
         hide_fields.init_hide_fields()
+        cmd_fields_handler = hide_fields
         return hide_fields
     except Exception as e:
         logging.error(f"Failed to initialize CMD fields hiding: {str(e)}")
         raise
-
-# Create the instance
-cmd_fields_handler = init_cmd_fields_hiding()
\ No newline at end of file
@@ -0,0 +1,115 @@
+from aqt import mw
+from aqt.qt import QTimer
+import json
+import logging
+import weakref
+from ..note_types import closet_note_types
+
+class EditorState:
+    """What the normalizer remembers about the note loaded in one editor"""
+
+    def __init__(self):
+        self.mid = None
+        self.block_index = None
+        self.last_block = None
+        self.timer = None
+
+class DebouncedEditorNormalizer:
+    """Normalizes the note in the editor once the block field settles, without writing it"""
+
+    DELAY_MS = 800
+
+    def __init__(self, updater):
+        self.updater = updater
+        self.logger = logging.getLogger(__name__)
+        self.states = weakref.WeakKeyDictionary()
+
+    def _state(self, editor):
+        state = self.states.get(editor)
+        if state is None:
+            state = self.states[editor] = EditorState()
+        note = editor.note
+        if state.mid != note.mid:
+            # The note type is only looked up when the editor switches to another one
+            state.mid = note.mid
+            info = closet_note_types.get(mw.col, note.mid)
+            state.block_index = info.block_index if info else None
+            state.last_block = None
+        return state
+
+    def _schedule(self, editor, state):
+        if state.timer is None:
+            editor_ref = weakref.ref(editor)
+            state.timer = QTimer(editor.widget)
+            state.timer.setSingleShot(True)
+            state.timer.timeout.connect(lambda: editor_ref() and self.flush(editor_ref()))
+        state.timer.start(self.DELAY_MS)
+
+    def flush(self, editor):
+        """Normalizes the block and cmds fields of the editor's note in memory if the block changed
+
+        Nothing is written here: the normalized block is also put into the field of the
+        webview, so the editor's next save of the field stores it instead of the typed text,
+        and the note is marked dirty so the next update pass covers it if no save comes.
+        """
+        try:
+            note = editor.note
+            if not note:
+                return
+            state = self._state(editor)
+            if state.timer is not None:
+                state.timer.stop()
+            if state.block_index is None:
+                return
+            if note.fields[state.block_index] == state.last_block:
+                return
+            block = note.fields[state.block_index]
+            fields = list(note.fields)
+            self.updater.normalize_note(note)
+            state.last_block = note.fields[state.block_index]
+            if state.last_block != block:
+                editor.web.eval(
+                    f"window.ClosetEditor && ClosetEditor.setFieldHtml({state.block_index}, "
+                    f"{json.dumps(state.last_block)});"
+                )
+            if note.fields != fields and note.id:
+                self.updater.dirty.mark(note.id)
+        except Exception as e:
+            self.logger.error(f"Error normalizing the editor note: {str(e)}")
+
+    def on_editor_will_munge_html(self, txt, editor):
+        """Only (re)starts the debounce timer when the block field is the one being edited"""
+        try:
+            if editor.note and editor.currentField is not None:
+                state = self._state(editor)
+                if state.block_index is not None and editor.currentField == state.block_index:
+                    self._schedule(editor, state)
+        except Exception as e:
+            self.logger.error(f"Error in on_editor_will_munge_html: {str(e)}")
+        return txt
+
+    def on_editor_did_unfocus_field(self, changed, note, field_index):
+        """Normalizes as soon as the block field loses focus instead of waiting for the timer"""
+        for editor in list(self.states.keys()):
+            state = self.states.get(editor)
+            if editor.note is note and state and state.block_index == field_index:
+                self.flush(editor)
+        # flush already put the normalized block into the webview, so no reload of every field is needed
+        return changed
+
+    def on_editor_did_load_note(self, editor):
+        """Forgets the previous note, which the editor saved before switching"""
+        state = self.states.get(editor)
+        if state:
+            if state.timer is not None:
+                state.timer.stop()
+            state.last_block = None
+
+    def on_add_cards_will_add_note(self, problem, note):
+        """Normalizes a new note in memory right before it is added"""
+        try:
+            if problem is None and closet_note_types.is_closet(mw.col, note.mid):
+                self.updater.normalize_note(note)
+        except Exception as e:
+            self.logger.error(f"Error normalizing the new note: {str(e)}")
+        return problem
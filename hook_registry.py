@@ -0,0 +1,97 @@
+import functools
+import logging
+import re
+import time
+
+class HookStats:
+    """Call count, error count and latency of one registered handler"""
+
+    def __init__(self, hook_name, handler_name):
+        self.hook_name = hook_name
+        self.handler_name = handler_name
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+
+    def record(self, elapsed):
+        self.calls += 1
+        self.total_time += elapsed
+        self.last_time = elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def as_dict(self):
+        return {
+            "hook": self.hook_name,
+            "handler": self.handler_name,
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": round(self.total_time * 1000, 3),
+            "mean_ms": round(self.total_time * 1000 / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_time * 1000, 3),
+            "last_ms": round(self.last_time * 1000, 3),
+        }
+
+class HookRegistry:
+    """Registers each handler on a hook at most once and times every call"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.handlers = {}
+
+    @staticmethod
+    def hook_name(hook):
+        """Turns a gui_hooks instance such as _ReviewerDidShowQuestionHook into reviewer_did_show_question"""
+        name = re.sub(r"(Hook|Filter)$", "", type(hook).__name__.strip("_"))
+        return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+    @staticmethod
+    def handler_name(handler):
+        return f"{handler.__module__}.{handler.__qualname__}"
+
+    def register(self, hook, handler, name=None):
+        """Appends the handler to the hook unless it is already registered; returns whether it was added"""
+        name = name or self.handler_name(handler)
+        key = (id(hook), name)
+        if key in self.handlers:
+            return False
+        stats = HookStats(self.hook_name(hook), name)
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.record(time.perf_counter() - start)
+
+        hook.append(wrapper)
+        self.handlers[key] = (hook, wrapper, stats)
+        return True
+
+    def unregister(self, hook, handler=None, name=None):
+        """Removes a handler previously added with register"""
+        name = name or self.handler_name(handler)
+        entry = self.handlers.pop((id(hook), name), None)
+        if entry:
+            hook.remove(entry[1])
+
+    def unregister_all(self):
+        for hook, wrapper, _ in self.handlers.values():
+            hook.remove(wrapper)
+        self.handlers = {}
+
+    def reset_stats(self):
+        for _, _, stats in self.handlers.values():
+            stats.__init__(stats.hook_name, stats.handler_name)
+
+    def stats(self):
+        """Returns the statistics of every registered handler"""
+        return [stats.as_dict() for _, _, stats in self.handlers.values()]
+
+# Shared registry used by every module of the add-on
+hook_registry = HookRegistry()
@@ -2,17 +2,45 @@ from aqt import gui_hooks
 from aqt.utils import showInfo
 
 from .closet_note_updater import closet_note_updater
-from .editor.buttons import closet_editor_changes
+from .editor.buttons import init_editor
+from .editor.hide_fields import init_cmd_fields_hiding
+from .editor.normalizer import DebouncedEditorNormalizer
+from .hook_registry import hook_registry
+from .note_types import closet_note_types
+from .runtime import closet_runtime
+from .scheduler import idle_scheduler
+
+editor_normalizer = DebouncedEditorNormalizer(closet_note_updater)
 
 def init_hooks():
     """Initializes the hooks"""
     try:
-        # Adds the necessary hooks
-        gui_hooks.reviewer_did_show_question.append(closet_note_updater.on_review_card)
-        gui_hooks.deck_browser_will_render_content.append(closet_note_updater.on_deck_browser)
-        gui_hooks.overview_will_render_content.append(closet_note_updater.on_overview_will_render_content)
-        gui_hooks.addcards_did_change_note_type.append(closet_note_updater.on_addcards_did_change_note_type)
-        gui_hooks.editor_will_munge_html.append(closet_note_updater.on_editor_will_munge_html)
+        # Adds the necessary hooks, each at most once
+        register = hook_registry.register
+        register(gui_hooks.reviewer_did_show_question, closet_note_updater.on_review_card)
+        register(gui_hooks.deck_browser_will_render_content, closet_note_updater.on_deck_browser)
+        register(gui_hooks.overview_will_render_content, closet_note_updater.on_overview_will_render_content)
+        register(gui_hooks.addcards_did_change_note_type, closet_note_updater.on_addcards_did_change_note_type)
+        register(gui_hooks.editor_will_munge_html, editor_normalizer.on_editor_will_munge_html)
+        register(gui_hooks.editor_did_unfocus_field, editor_normalizer.on_editor_did_unfocus_field)
+        register(gui_hooks.editor_did_load_note, editor_normalizer.on_editor_did_load_note)
+        register(gui_hooks.add_cards_will_add_note, editor_normalizer.on_add_cards_will_add_note)
+        register(gui_hooks.add_cards_did_add_note, closet_note_updater.on_note_changed)
+        register(gui_hooks.editor_did_fire_typing_timer, closet_note_updater.on_note_changed)
+        register(gui_hooks.profile_will_close, closet_note_updater.on_profile_will_close)
+        register(gui_hooks.operation_did_execute, closet_note_types.on_operation_did_execute)
+        register(gui_hooks.browser_will_search, closet_note_updater.tag_index.on_browser_will_search)
+        register(gui_hooks.state_did_change, idle_scheduler.on_state_did_change)
+        register(gui_hooks.editor_did_load_note, idle_scheduler.on_editor_did_load_note)
+        register(gui_hooks.profile_will_close, idle_scheduler.on_profile_will_close)
+        register(gui_hooks.webview_will_set_content, closet_runtime.on_webview_will_set_content)
+        register(gui_hooks.webview_did_receive_js_message, closet_runtime.on_webview_did_receive_js_message)
+        register(gui_hooks.card_will_show, closet_runtime.on_card_will_show)
+        idle_scheduler.start()
+
+        # Editor buttons and cmds field hiding
+        init_editor()
+        init_cmd_fields_hiding()
 
     except Exception as e:
         showInfo(f"Error in init_hooks: {str(e)}")
@@ -0,0 +1,72 @@
+import logging
+import re
+import threading
+from .config import load_config
+
+CMDS_FIELD = re.compile(r'cmds(\d+)$')
+
+class NoteTypeInfo:
+    """Field layout of one Closet note type"""
+
+    def __init__(self, model):
+        self.mid = model['id']
+        self.name = model['name']
+        self.field_names = [field['name'] for field in model['flds']]
+        self.block_index = self.field_names.index('block') if 'block' in self.field_names else None
+        # cmds number -> field index
+        self.cmds = {}
+        for index, name in enumerate(self.field_names):
+            match = CMDS_FIELD.match(name)
+            if match:
+                self.cmds[int(match.group(1))] = index
+        self.max_cmds = max(self.cmds, default=0)
+
+    def lacks_fields(self, max_tag_num):
+        """Tells whether more cmdsN fields are needed to hold max_tag_num tags"""
+        return max_tag_num > self.max_cmds
+
+class ClosetNoteTypeRegistry:
+    """Resolves the configured Closet note types to their ids once and caches their field layout"""
+
+    def __init__(self, names=('Closet-r',)):
+        self.names = tuple(names)
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self._col = None
+        self._infos = None
+
+    def _resolve(self, col):
+        with self.lock:
+            if self._infos is not None and self._col is col:
+                return self._infos
+            infos = {}
+            for entry in col.models.all_names_and_ids():
+                if entry.name in self.names:
+                    infos[entry.id] = NoteTypeInfo(col.models.get(entry.id))
+            self._col = col
+            self._infos = infos
+            return infos
+
+    def invalidate(self):
+        """Forgets the cached ids and layouts; they are resolved again on next use"""
+        with self.lock:
+            self._infos = None
+
+    def mids(self, col):
+        """Returns the ids of the Closet note types present in the collection"""
+        return list(self._resolve(col))
+
+    def is_closet(self, col, mid):
+        return mid in self._resolve(col)
+
+    def get(self, col, mid):
+        """Returns the layout of a Closet note type, or None when the id is not one"""
+        return self._resolve(col).get(mid)
+
+    def on_operation_did_execute(self, changes, handler):
+        """Drops the cache whenever a note type was added, renamed or had its fields changed"""
+        if getattr(changes, 'notetype', False):
+            self.invalidate()
+
+# Shared registry of the note types configured in config.json
+closet_note_types = ClosetNoteTypeRegistry(load_config()["note_types"])
@@ -0,0 +1,75 @@
+from collections import deque
+import logging
+import os
+from . import tokenizer
+
+def normalize_blocks(blocks):
+    """Runs in a worker process: normalizes each block and returns (text, max tag) pairs"""
+    return [tokenizer.normalize(block) for block in blocks]
+
+class ParallelNormalizer:
+    """Normalizes the blocks of streamed note chunks in a process pool, ahead of the main loop"""
+
+    def __init__(self, workers=0, min_notes=20000):
+        self.workers = workers
+        self.min_notes = min_notes
+        self.logger = logging.getLogger(__name__)
+        self.broken = False
+
+    def worker_count(self):
+        """The configured number of workers, or one less than the number of CPUs when 0"""
+        return self.workers if self.workers > 0 else max(1, (os.cpu_count() or 2) - 1)
+
+    def should_run(self, total):
+        """Small collections skip the process startup cost and run on the main process"""
+        return not self.broken and total >= self.min_notes and self.worker_count() > 1
+
+    def prewarm(self, chunks, cache):
+        """Yields the chunks unchanged, in order, once the blocks missing from the cache have been normalized
+
+        At most two chunks per worker are in flight, so memory stays bounded while the
+        main process consumes the chunks already done. If the pool cannot be used, the
+        remaining chunks are yielded as they are and normalized by the caller.
+        """
+        # Imported here: the process pool machinery adds noticeably to the add-on's load time
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        try:
+            executor = ProcessPoolExecutor(
+                max_workers=self.worker_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Parallel rebuild unavailable, falling back to one process: {str(e)}")
+            self.broken = True
+            yield from chunks
+            return
+
+        in_flight = deque()
+        window = self.worker_count() * 2
+        try:
+            for chunk in chunks:
+                if self.broken:
+                    yield chunk
+                    continue
+                blocks = list({raw.block for raw in chunk if raw.block and not cache.contains(raw.block)})
+                in_flight.append((chunk, blocks, executor.submit(normalize_blocks, blocks) if blocks else None))
+                while len(in_flight) >= window:
+                    yield self._collect(in_flight.popleft(), cache)
+            while in_flight:
+                yield self._collect(in_flight.popleft(), cache)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _collect(self, entry, cache):
+        from concurrent.futures.process import BrokenProcessPool
+        chunk, blocks, future = entry
+        if future is None or self.broken:
+            return chunk
+        try:
+            for block, (normalized, max_tag) in zip(blocks, future.result()):
+                cache.store(block, normalized, max_tag)
+        except (BrokenProcessPool, OSError) as e:
+            self.logger.error(f"Parallel rebuild failed, falling back to one process: {str(e)}")
+            self.broken = True
+        return chunk
@@ -0,0 +1,99 @@
+from collections import Counter, deque
+import json
+import logging
+import time
+from .hook_registry import hook_registry
+
+class ErrorCounter(logging.Handler):
+    """Logging handler that aggregates the add-on's errors by logger and message"""
+
+    def __init__(self, stats):
+        super().__init__(level=logging.ERROR)
+        self.stats = stats
+
+    def emit(self, record):
+        self.stats.errors[f"{record.name}: {record.getMessage()}"] += 1
+
+class PerfStats:
+    """Live statistics of the running add-on, with a ring buffer of recent update passes"""
+
+    def __init__(self, history_size=200):
+        self.history = deque(maxlen=history_size)
+        self.totals = Counter()
+        self.counters = Counter()
+        self.errors = Counter()
+        self.sources = {}
+        self.started = time.time()
+
+    def install_error_counter(self, logger_name):
+        """Counts every error logged under the add-on's package logger"""
+        logger = logging.getLogger(logger_name)
+        if not any(isinstance(handler, ErrorCounter) for handler in logger.handlers):
+            logger.addHandler(ErrorCounter(self))
+
+    def add_source(self, name, snapshot):
+        """Registers a callable whose dict result is included in every snapshot"""
+        self.sources[name] = snapshot
+
+    def increment(self, name, amount=1):
+        self.counters[name] += amount
+
+    def record_pass(self, kind, scanned, modified, elapsed, cancelled=False):
+        """Records one update pass: how many notes were read and how many were actually written"""
+        self.totals["passes"] += 1
+        self.totals["notes_scanned"] += scanned
+        self.totals["notes_modified"] += modified
+        self.totals["pass_ms"] += elapsed * 1000
+        self.history.append({
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "kind": kind,
+            "scanned": scanned,
+            "modified": modified,
+            "ms": round(elapsed * 1000, 3),
+            "cancelled": cancelled,
+        })
+
+    def record_timing(self, name, elapsed):
+        """Records a timing that is not a hook call, e.g. the editor load time"""
+        self.counters[f"{name}_count"] += 1
+        self.counters[f"{name}_ms"] += elapsed * 1000
+        self.history.append({
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "kind": name,
+            "ms": round(elapsed * 1000, 3),
+        })
+
+    def snapshot(self):
+        """Returns every statistic as a JSON-serializable dict"""
+        sources = {}
+        for name, snapshot in self.sources.items():
+            try:
+                sources[name] = snapshot()
+            except Exception as e:
+                sources[name] = {"error": str(e)}
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "totals": dict(self.totals),
+            "counters": dict(self.counters),
+            "hooks": sorted(hook_registry.stats(), key=lambda stats: -stats["total_ms"]),
+            "sources": sources,
+            "errors": dict(self.errors.most_common()),
+            "history": list(self.history),
+        }
+
+    def export(self, path):
+        """Writes a snapshot to a JSON file"""
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def reset(self):
+        hook_registry.reset_stats()
+        self.history.clear()
+        self.totals.clear()
+        self.counters.clear()
+        self.errors.clear()
+        self.started = time.time()
+
+# Shared statistics used by every module of the add-on
+perf_stats = PerfStats()
+perf_stats.install_error_counter(__name__.rpartition(".")[0] or __name__)
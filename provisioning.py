@@ -0,0 +1,36 @@
+import logging
+from .perf_stats import perf_stats
+
+class FieldProvisioner:
+    """Adds the cmdsN fields a Closet note type needs in a single model save"""
+
+    def __init__(self, headroom=0):
+        self.headroom = headroom
+        self.logger = logging.getLogger(__name__)
+
+    def missing_fields(self, model, max_tag_num):
+        """Returns the cmdsN field names the model lacks to hold max_tag_num tags plus the headroom"""
+        if max_tag_num <= 0:
+            return []
+        field_names = {field['name'] for field in model['flds']}
+        if f'cmds{max_tag_num}' in field_names:
+            return []
+        return [
+            f'cmds{i}' for i in range(1, max_tag_num + self.headroom + 1)
+            if f'cmds{i}' not in field_names
+        ]
+
+    def ensure(self, col, mid, max_tag_num):
+        """Adds every missing cmdsN field to the model and saves it once; returns whether it changed"""
+        model = col.models.get(mid)
+        missing = self.missing_fields(model, max_tag_num)
+        if not missing:
+            return False
+        for field_name in missing:
+            col.models.addField(model, col.models.newField(field_name))
+        col.models.save(model)
+        perf_stats.increment("model_saves")
+        perf_stats.increment("schema_changes")
+        perf_stats.increment("cmds_fields_added", len(missing))
+        self.logger.info(f"Added {len(missing)} cmds fields to {model['name']}")
+        return True
@@ -0,0 +1,222 @@
+from aqt import mw
+from aqt.operations import CollectionOp
+from aqt.reviewer import Reviewer
+from aqt.utils import askUser, showInfo
+from anki.collection import OpChangesWithCount
+import hashlib
+import logging
+import os
+import re
+from .note_types import closet_note_types
+from .perf_stats import perf_stats
+
+# Inline scripts, i.e. without a src attribute
+INLINE_SCRIPT = re.compile(r'<script(?![^>]*\bsrc=)[^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE)
+RUNTIME_REFERENCE = re.compile(r'<script src="(_closet-runtime-([0-9a-f]+)\.js)"></script>')
+
+# The media file defines the script as a function once per page and runs it for every card.
+# A copy preloaded into the desktop reviewer page only defines it.
+RUNTIME_PREFIX = """/* Closet runtime {key}, moved out of the note type templates by the Closet add-on */
+(function (runtimes, script) {{
+    if (!runtimes["{key}"]) {{
+        runtimes["{key}"] = function () {{
+"""
+RUNTIME_SUFFIX = """
+        }};
+    }}
+    if (!(script && script.hasAttribute("data-closet-preload"))) {{
+        runtimes["{key}"]();
+    }}
+}})(window.closetRuntimes = window.closetRuntimes || {{}}, document.currentScript);
+"""
+
+class ClosetRuntime:
+    """Moves the Closet script out of the note type templates into a versioned media file
+
+    The inline script of every card is compiled and run from scratch each time a
+    card is shown. As a media file named after its content hash,
+    _closet-runtime-<hash>.js, the script is wrapped in a function that is defined
+    once per page and only called for each card. The desktop reviewer preloads the
+    file into its page and the cards call the function directly; AnkiDroid,
+    AnkiMobile and AnkiWeb keep loading it with the plain script tag from the
+    synced media folder. The leading underscore keeps Check Media from reporting
+    it as unused.
+    """
+
+    UNDO_LABEL = "Change Closet Runtime"
+    # Smaller inline scripts are per-card setup, not the runtime, and stay in place
+    MIN_RUNTIME_CHARS = 2000
+    TIMING_SCRIPT = "web/closet_render_timing.js"
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        # Names of the note types whose scripts use template fields and were left inline by the last conversion
+        self.skipped = []
+        # Runtime file name -> key of the files preloaded into the current reviewer page
+        self.preloaded = {}
+
+    @staticmethod
+    def runtime_key(script):
+        return hashlib.sha1(script.encode("utf-8")).hexdigest()[:12]
+
+    @staticmethod
+    def wrap(key, script):
+        return RUNTIME_PREFIX.format(key=key) + script + RUNTIME_SUFFIX.format(key=key)
+
+    @staticmethod
+    def unwrap(key, content):
+        """Returns the original script of a runtime file"""
+        prefix, suffix = RUNTIME_PREFIX.format(key=key), RUNTIME_SUFFIX.format(key=key)
+        if content.startswith(prefix) and content.endswith(suffix):
+            return content[len(prefix):len(content) - len(suffix)]
+        return content
+
+    def externalize_model(self, col, model):
+        """Writes each large inline script of the model's templates to media and references it; returns how many
+
+        Scripts containing {{...}} are filled in by Anki for every card, so a static
+        copy would freeze them; they stay inline and the model is listed in skipped.
+        """
+        moved = {}
+
+        def replace(match):
+            script = match.group(1)
+            if len(script) < self.MIN_RUNTIME_CHARS:
+                return match.group(0)
+            if "{{" in script:
+                if model['name'] not in self.skipped:
+                    self.skipped.append(model['name'])
+                return match.group(0)
+            if script not in moved:
+                key = self.runtime_key(script)
+                moved[script] = col.media.write_data(
+                    f"_closet-runtime-{key}.js", self.wrap(key, script).encode("utf-8")
+                )
+            return f'<script src="{moved[script]}"></script>'
+
+        for template in model['tmpls']:
+            for side in ('qfmt', 'afmt'):
+                if side in template:
+                    template[side] = INLINE_SCRIPT.sub(replace, template[side])
+        return len(moved)
+
+    def inline_model(self, col, model):
+        """Puts the runtime files referenced by the model's templates back inline; returns how many"""
+        restored = {}
+
+        def replace(match):
+            name, key = match.groups()
+            if name not in restored:
+                path = os.path.join(col.media.dir(), name)
+                if not os.path.exists(path):
+                    self.logger.error(f"Closet runtime {name} is missing from the media folder")
+                    return match.group(0)
+                with open(path, encoding="utf-8") as f:
+                    restored[name] = self.unwrap(key, f.read())
+            return f"<script>{restored[name]}</script>"
+
+        for template in model['tmpls']:
+            for side in ('qfmt', 'afmt'):
+                if side in template:
+                    template[side] = RUNTIME_REFERENCE.sub(replace, template[side])
+        return len(restored)
+
+    def convert(self, col, externalize):
+        """Externalizes or inlines the runtime of every Closet note type in one undo step"""
+        self.skipped = []
+        undo_entry = col.add_custom_undo_entry(self.UNDO_LABEL)
+        scripts = 0
+        for mid in closet_note_types.mids(col):
+            model = col.models.get(mid)
+            count = self.externalize_model(col, model) if externalize else self.inline_model(col, model)
+            if count:
+                col.models.save(model)
+                perf_stats.increment("model_saves")
+                scripts += count
+        return OpChangesWithCount(changes=col.merge_undo_entries(undo_entry), count=scripts)
+
+    def run(self, externalize):
+        """Asks for confirmation and converts the templates in the background"""
+        if externalize:
+            question = ("Move the Closet script out of the Closet note type templates into a "
+                        "_closet-runtime file in the media folder?\n\nThe script then runs inside a function: "
+                        "variables it declares at the top level are no longer global.")
+        else:
+            question = "Put the Closet script back inline into the Closet note type templates?"
+        if not askUser(question):
+            return
+
+        def on_success(result):
+            if not result.count:
+                message = "No Closet script was found to convert."
+            elif externalize:
+                message = (f"{result.count} Closet scripts were moved to the media folder. "
+                           "Sync media so other devices receive them.")
+            else:
+                message = f"{result.count} Closet scripts were put back inline."
+            if self.skipped:
+                message += ("\n\nScripts using template fields ({{...}}) were left inline in: "
+                            f"{', '.join(self.skipped)}.")
+            showInfo(message)
+
+        def on_failure(exc):
+            self.logger.error(f"Error converting the Closet runtime: {str(exc)}")
+            showInfo(f"Error converting the Closet runtime: {str(exc)}")
+
+        CollectionOp(parent=mw, op=lambda col: self.convert(col, externalize)).success(
+            on_success
+        ).failure(on_failure).run_in_background()
+
+    def referenced_runtimes(self, col):
+        """Returns the runtime files the Closet note type templates load and the media folder has, by name"""
+        runtimes = {}
+        for mid in closet_note_types.mids(col):
+            for template in col.models.get(mid)['tmpls']:
+                for side in ('qfmt', 'afmt'):
+                    for name, key in RUNTIME_REFERENCE.findall(template.get(side, '')):
+                        if os.path.exists(os.path.join(col.media.dir(), name)):
+                            runtimes[name] = key
+        return runtimes
+
+    def on_webview_will_set_content(self, web_content, context):
+        """Adds the render timing script to the reviewer webview and preloads the runtime files once per page"""
+        if isinstance(context, Reviewer):
+            addon_package = mw.addonManager.addonFromModule(__name__)
+            web_content.js.append(f"/_addons/{addon_package}/{self.TIMING_SCRIPT}")
+            try:
+                self.preloaded = self.referenced_runtimes(mw.col)
+            except Exception as e:
+                self.logger.error(f"Error preloading the Closet runtime: {str(e)}")
+                self.preloaded = {}
+            for name in self.preloaded:
+                web_content.head += f'<script src="{name}" data-closet-preload></script>'
+
+    def on_card_will_show(self, text, card, kind):
+        """In the reviewer, calls the preloaded runtime instead of loading and running its file again"""
+        if not self.preloaded or not kind.startswith("review") or "_closet-runtime-" not in text:
+            return text
+
+        def replace(match):
+            name, key = match.groups()
+            if name not in self.preloaded:
+                return match.group(0)
+            return f'<script>closetRuntimes["{key}"]();</script>'
+
+        return RUNTIME_REFERENCE.sub(replace, text)
+
+    def on_webview_did_receive_js_message(self, handled, message, context):
+        """Records the render time of Closet cards, split by inline and media runtime"""
+        if not message.startswith("closet:render:"):
+            return handled
+        try:
+            _, _, side, elapsed_ms = message.split(":")
+            card = mw.reviewer.card if mw.reviewer else None
+            if card is not None and closet_note_types.is_closet(mw.col, card.note().mid):
+                template = card.template()
+                runtime = "media" if "_closet-runtime-" in template.get('qfmt', '') else "inline"
+                perf_stats.record_timing(f"card_render_{side}_{runtime}", float(elapsed_ms) / 1000)
+        except Exception as e:
+            self.logger.error(f"Error recording card render time: {str(e)}")
+        return (True, None)
+
+closet_runtime = ClosetRuntime()
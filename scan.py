@@ -0,0 +1,64 @@
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from anki.utils import ids2str, split_fields
+
+class RawNote(NamedTuple):
+    """The parts of a Closet note the updater reads, taken straight from the notes table"""
+    id: int
+    mid: int
+    mod: int
+    block: str
+    # cmds number -> field value
+    cmds: Dict[int, str]
+
+def _to_raw(registry, col, row) -> Optional[RawNote]:
+    note_id, mid, mod, flds = row
+    info = registry.get(col, mid)
+    if info is None or info.block_index is None:
+        return None
+    fields = split_fields(flds)
+    return RawNote(
+        note_id, mid, mod, fields[info.block_index],
+        {number: fields[index] for number, index in info.cmds.items() if index < len(fields)}
+    )
+
+def iter_chunks(col, registry, note_ids=None, chunk_size=1000) -> Iterator[List[RawNote]]:
+    """Streams the Closet notes in fixed-size chunks, keeping memory flat regardless of collection size
+
+    With note_ids, only those notes are read; otherwise every note of the registered
+    Closet note types is read in id order.
+    """
+    mids = registry.mids(col)
+    if not mids:
+        return
+    mid_filter = f"mid in {ids2str(mids)}"
+    if note_ids is not None:
+        ordered = sorted(note_ids)
+        for start in range(0, len(ordered), chunk_size):
+            rows = col.db.all(
+                f"select id, mid, mod, flds from notes where id in {ids2str(ordered[start:start + chunk_size])} "
+                f"and {mid_filter} order by id"
+            )
+            yield [raw for raw in (_to_raw(registry, col, row) for row in rows) if raw]
+        return
+    last_id = 0
+    while True:
+        rows = col.db.all(
+            f"select id, mid, mod, flds from notes where {mid_filter} and id > ? order by id limit ?",
+            last_id, chunk_size
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [raw for raw in (_to_raw(registry, col, row) for row in rows) if raw]
+
+def iter_raw_notes(col, registry, note_ids=None, chunk_size=1000) -> Iterator[RawNote]:
+    """Streams the Closet notes one lightweight record at a time"""
+    for chunk in iter_chunks(col, registry, note_ids, chunk_size):
+        yield from chunk
+
+def count_notes(col, registry, note_ids=None) -> int:
+    """Returns how many notes iter_chunks will read"""
+    if note_ids is not None:
+        return len(note_ids)
+    mids = registry.mids(col)
+    return col.db.scalar(f"select count() from notes where mid in {ids2str(mids)}") if mids else 0
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+import logging
+import time
+from aqt import mw
+from aqt.qt import QEvent, QObject, QTimer
+from .perf_stats import perf_stats
+
+class InputActivityFilter(QObject):
+    """Reports every keyboard or mouse input anywhere in the application"""
+
+    def __init__(self, on_input):
+        super().__init__()
+        self.on_input = on_input
+        self.input_events = {QEvent.Type.KeyPress, QEvent.Type.MouseButtonPress, QEvent.Type.Wheel}
+
+    def eventFilter(self, obj, event):
+        if event.type() in self.input_events:
+            self.on_input()
+        return False
+
+class IdleScheduler:
+    """Runs queued maintenance tasks in short slices while Anki is idle
+
+    A task is a generator function; each ``yield`` marks a point where the work
+    can be paused. Slices run back to back through a zero-delay timer, so the Qt
+    event loop gets control between them, and stop as soon as the user reviews,
+    edits or types. A paused task resumes where it stopped once Anki is idle again.
+    A task that yields WAIT, e.g. while a background operation it depends on is
+    running, ends the slice and is resumed POLL_MS later.
+    """
+
+    IDLE_STATES = ("deckBrowser", "overview")
+    IDLE_SECONDS = 3
+    SLICE_MS = 20
+    POLL_MS = 1000
+    WAIT = "wait"
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        # name -> generator function, in the order they were queued
+        self.tasks = OrderedDict()
+        # (name, generator, seconds spent so far) of the task being sliced
+        self.running = None
+        self.last_input = time.monotonic()
+        self.timer = None
+        self.input_filter = None
+        perf_stats.add_source("idle_scheduler", self.stats)
+
+    def start(self):
+        """Creates the timer and starts watching for user input"""
+        if self.timer is not None:
+            return
+        self.timer = QTimer(mw)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._tick)
+        self.input_filter = InputActivityFilter(self.touch)
+        mw.app.installEventFilter(self.input_filter)
+
+    def enqueue(self, name, task):
+        """Queues a task unless one with the same name is already waiting"""
+        if name not in self.tasks:
+            self.tasks[name] = task
+        self._schedule(self.POLL_MS)
+
+    def touch(self):
+        """Records user activity, which postpones the next slice by IDLE_SECONDS"""
+        self.last_input = time.monotonic()
+
+    def clear(self):
+        """Drops every queued and paused task, e.g. when the collection is closing"""
+        self.tasks.clear()
+        if self.running is not None:
+            self.running[1].close()
+            self.running = None
+        if self.timer is not None:
+            self.timer.stop()
+
+    def is_idle(self):
+        """Anki is idle on the deck browser or overview, with its main window (or none) active and no recent input"""
+        if not mw.col or mw.state not in self.IDLE_STATES:
+            return False
+        if time.monotonic() - self.last_input < self.IDLE_SECONDS:
+            return False
+        active = mw.app.activeWindow()
+        return active is None or active is mw
+
+    def _schedule(self, delay):
+        if self.timer is not None and not self.timer.isActive():
+            self.timer.start(delay)
+
+    def _tick(self):
+        if not self.tasks and self.running is None:
+            return
+        if not self.is_idle():
+            self._schedule(self.POLL_MS)
+            return
+        start = time.perf_counter()
+        deadline = start + self.SLICE_MS / 1000
+        waiting = False
+        while time.perf_counter() < deadline and not waiting:
+            if self.running is None:
+                if not self.tasks:
+                    break
+                name, task = self.tasks.popitem(last=False)
+                self.running = (name, task(), 0.0)
+            name, generator, spent = self.running
+            step_start = time.perf_counter()
+            try:
+                waiting = next(generator) == self.WAIT
+                self.running = (name, generator, spent + time.perf_counter() - step_start)
+            except StopIteration:
+                self.running = None
+                perf_stats.record_timing(f"idle_{name}", spent + time.perf_counter() - step_start)
+            except Exception as e:
+                self.running = None
+                self.logger.error(f"Error in idle task {name}: {str(e)}")
+        perf_stats.increment("idle_slices")
+        if self.tasks or self.running is not None:
+            self._schedule(self.POLL_MS if waiting else 0)
+
+    def on_state_did_change(self, new_state, old_state):
+        """Leaving the deck browser or overview, e.g. to review, preempts the running task"""
+        if new_state not in self.IDLE_STATES:
+            self.touch()
+
+    def on_editor_did_load_note(self, editor):
+        self.touch()
+
+    def on_profile_will_close(self):
+        self.clear()
+
+    def stats(self):
+        return {
+            "queued": list(self.tasks),
+            "running": self.running[0] if self.running else None,
+        }
+
+idle_scheduler = IdleScheduler()
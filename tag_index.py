@@ -0,0 +1,211 @@
+from typing import Dict, Iterable, List, Optional
+from anki.utils import ids2str
+import logging
+import os
+import re
+import sqlite3
+import threading
+from . import tokenizer
+from .block_cache import USER_FILES_DIR
+
+# closet:mix, closet:c3, closet:max>20, closet:count<=5, closet:c>20 (number of c tags)
+SEARCH_TERM = re.compile(r'(?<![\w:])"?closet:([^\s"()]+)"?', re.IGNORECASE)
+SEARCH_EXPRESSION = re.compile(r'^(max|count|cl|cx|c|mix|mc)(?:(\d+)|(<=|>=|=|<|>)(\d+))?$')
+
+class TagIndex:
+    """Sidecar index of the Closet tags of every note, kept in user_files and updated by the update passes
+
+    One file per profile maps each note id to its tag kinds, tag numbers and
+    highest tag, so Browser searches such as closet:mix or closet:max>20 are
+    answered without reading the notes.
+    """
+
+    CHUNK_SIZE = 1000
+    COUNT_BUCKETS = ((0, 0), (1, 5), (6, 10), (11, 20), (21, 50), (51, None))
+
+    def __init__(self, path=None):
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+
+    def open(self, profile_name):
+        """Points the index at the file of the given profile"""
+        safe_name = re.sub(r'[^\w.-]', '_', profile_name)
+        self.path = os.path.join(USER_FILES_DIR, f"tag_index-{safe_name}.sqlite3")
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        connection.executescript(
+            "create table if not exists notes ("
+            "id integer primary key, mod integer not null, max_tag integer not null, tag_count integer not null);"
+            "create table if not exists tags (note_id integer not null, kind text not null, number integer);"
+            "create index if not exists tags_kind on tags (kind, number);"
+            "create index if not exists tags_note on tags (note_id);"
+            "create index if not exists notes_max_tag on notes (max_tag);"
+        )
+        return connection
+
+    def mods(self, note_ids=None) -> Dict[int, int]:
+        """Returns the note mod time each indexed note had when it was indexed"""
+        if self.path is None:
+            return {}
+        try:
+            connection = self._connect()
+            try:
+                if note_ids is None:
+                    return dict(connection.execute("select id, mod from notes"))
+                note_ids = list(note_ids)
+                mods = {}
+                for offset in range(0, len(note_ids), self.CHUNK_SIZE):
+                    chunk = note_ids[offset:offset + self.CHUNK_SIZE]
+                    mods.update(connection.execute(f"select id, mod from notes where id in {ids2str(chunk)}"))
+                return mods
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error reading tag index: {str(e)}")
+            return {}
+
+    def ids(self) -> List[int]:
+        """Returns the ids of every indexed note"""
+        if self.path is None:
+            return []
+        try:
+            connection = self._connect()
+            try:
+                return [row[0] for row in connection.execute("select id from notes")]
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error reading tag index: {str(e)}")
+            return []
+
+    def remove(self, note_ids: Iterable[int]):
+        """Drops the entries of the given notes"""
+        note_ids = list(note_ids)
+        if self.path is None or not note_ids:
+            return
+        with self.lock:
+            try:
+                connection = self._connect()
+                try:
+                    with connection:
+                        connection.execute(f"delete from tags where note_id in {ids2str(note_ids)}")
+                        connection.execute(f"delete from notes where id in {ids2str(note_ids)}")
+                finally:
+                    connection.close()
+            except sqlite3.Error as e:
+                self.logger.error(f"Error updating tag index: {str(e)}")
+
+    def update(self, col, blocks: Dict[int, str], keep_ids: Optional[Iterable[int]] = None):
+        """Indexes the given normalized blocks under the notes' current mod times
+
+        With keep_ids, after a full pass, entries of notes not in it (deleted
+        notes or notes no longer of a Closet type) are removed.
+        """
+        if self.path is None or (not blocks and keep_ids is None):
+            return
+        note_ids = list(blocks)
+        mods = {}
+        for offset in range(0, len(note_ids), self.CHUNK_SIZE):
+            chunk = note_ids[offset:offset + self.CHUNK_SIZE]
+            mods.update(col.db.all(f"select id, mod from notes where id in {ids2str(chunk)}"))
+        note_rows = []
+        tag_rows = []
+        for note_id, text in blocks.items():
+            if note_id not in mods:
+                continue
+            tags = tokenizer.tokenize(text)
+            note_rows.append((note_id, mods[note_id], tokenizer.max_tag_number(tags), len(tags)))
+            tag_rows.extend((note_id, tag.kind, tag.number) for tag in tags)
+        with self.lock:
+            try:
+                connection = self._connect()
+                try:
+                    with connection:
+                        connection.execute("create temp table changed (id integer primary key)")
+                        connection.executemany("insert into changed values (?)", ((row[0],) for row in note_rows))
+                        connection.execute("delete from tags where note_id in (select id from changed)")
+                        connection.executemany("insert or replace into notes values (?, ?, ?, ?)", note_rows)
+                        connection.executemany("insert into tags values (?, ?, ?)", tag_rows)
+                        if keep_ids is not None:
+                            connection.execute("create temp table kept (id integer primary key)")
+                            connection.executemany("insert or ignore into kept values (?)", ((i,) for i in keep_ids))
+                            connection.execute("delete from tags where note_id not in (select id from kept)")
+                            connection.execute("delete from notes where id not in (select id from kept)")
+                finally:
+                    connection.close()
+            except sqlite3.Error as e:
+                self.logger.error(f"Error updating tag index: {str(e)}")
+
+    def search(self, expression) -> Optional[List[int]]:
+        """Returns the ids of the notes matching one closet: expression, or None when it is not valid"""
+        match = SEARCH_EXPRESSION.match(expression.lower())
+        if not match or self.path is None:
+            return None
+        name, number, operator, value = match.groups()
+        if name in ('max', 'count') and operator is None:
+            return None
+        if name == 'max':
+            query, args = f"select id from notes where max_tag {operator} ?", (int(value),)
+        elif name == 'count':
+            query, args = f"select id from notes where tag_count {operator} ?", (int(value),)
+        elif operator is not None:
+            query = (f"select id from notes where (select count(*) from tags "
+                     f"where tags.note_id = notes.id and kind = ?) {operator} ?")
+            args = (name, int(value))
+        elif number is not None:
+            query, args = "select distinct note_id from tags where kind = ? and number = ?", (name, int(number))
+        else:
+            query, args = "select distinct note_id from tags where kind = ?", (name,)
+        try:
+            connection = self._connect()
+            try:
+                return [row[0] for row in connection.execute(query, args)]
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error searching tag index: {str(e)}")
+            return None
+
+    def rewrite_search(self, text):
+        """Replaces every closet: term of a Browser search with the matching note ids"""
+        def replace(match):
+            note_ids = self.search(match.group(1))
+            if note_ids is None:
+                return match.group(0)
+            return f"nid:{','.join(map(str, note_ids)) or '0'}"
+        return SEARCH_TERM.sub(replace, text)
+
+    def on_browser_will_search(self, context):
+        if context.search and "closet:" in context.search.lower():
+            context.search = self.rewrite_search(context.search)
+
+    def summary(self):
+        """Returns the distribution of tags over the indexed notes"""
+        if self.path is None:
+            return None
+        try:
+            connection = self._connect()
+            try:
+                notes = connection.execute("select count(*) from notes").fetchone()[0]
+                buckets = []
+                for low, high in self.COUNT_BUCKETS:
+                    label = f"{low}" if low == high else (f"{low}-{high}" if high else f"> {low - 1}")
+                    condition = "tag_count >= ?" + (" and tag_count <= ?" if high is not None else "")
+                    args = (low, high) if high is not None else (low,)
+                    tag_notes = connection.execute(f"select count(*) from notes where {condition}", args).fetchone()[0]
+                    max_notes = connection.execute(
+                        f"select count(*) from notes where {condition.replace('tag_count', 'max_tag')}", args
+                    ).fetchone()[0]
+                    buckets.append((label, tag_notes, max_notes))
+                kinds = connection.execute(
+                    "select kind, count(distinct note_id), count(*) from tags group by kind order by count(*) desc"
+                ).fetchall()
+                return {"notes": notes, "buckets": buckets, "kinds": kinds}
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error reading tag index: {str(e)}")
+            return None
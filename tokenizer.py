@@ -0,0 +1,87 @@
+from typing import List, NamedTuple, Optional, Tuple
+import re
+
+# Opening of every Closet tag the add-on cares about, e.g. [[c3::, [[cl1::, [[mix::
+TAG_PATTERN = re.compile(r'\[\[(cl|cx|c|mix|mc)(\d*)::')
+# Opening of an Anki cloze deletion (or any other {{), and every closing }}
+CLOZE_DELIMITER = re.compile(r'\{\{(?:c(\d+)::)?|\}\}')
+
+class Tag(NamedTuple):
+    kind: str
+    number: Optional[int]
+    start: int
+    end: int
+
+def tokenize(text: str) -> List[Tag]:
+    """Scans the text once and returns every Closet tag opening with its kind, number and span"""
+    return [
+        Tag(match.group(1), int(match.group(2)) if match.group(2) else None, match.start(), match.end())
+        for match in TAG_PATTERN.finditer(text)
+    ]
+
+def max_tag_number(tags: List[Tag]) -> int:
+    """Returns the highest numbered tag in the list, or 0 when there is none"""
+    return max((tag.number for tag in tags if tag.number is not None), default=0)
+
+def rebuild(text: str, tags: List[Tag], renumber_cloze=True, collapse_mix=True) -> Tuple[str, int]:
+    """Renumbers the c tags to 1..N and drops the number of a lone mix tag, returning the new text and its max tag"""
+    renumbered = {}
+    if renumber_cloze:
+        numbers = sorted({tag.number for tag in tags if tag.kind == 'c' and tag.number is not None})
+        renumbered = {old: new for new, old in enumerate(numbers, start=1)}
+    lone_mix = collapse_mix and sum(1 for tag in tags if tag.kind == 'mix') == 1
+
+    parts = []
+    position = 0
+    max_tag = 0
+    for tag in tags:
+        number = tag.number
+        if tag.kind == 'c' and number is not None:
+            number = renumbered.get(number, number)
+        elif tag.kind == 'mix' and lone_mix:
+            number = None
+        if number is not None and number > max_tag:
+            max_tag = number
+        if number != tag.number:
+            parts.append(text[position:tag.start])
+            parts.append(f"[[{tag.kind}{'' if number is None else number}::")
+            position = tag.end
+
+    if not parts:
+        return text, max_tag
+    parts.append(text[position:])
+    return ''.join(parts), max_tag
+
+def cloze_to_closet(text: str) -> str:
+    """Converts Anki cloze deletions {{cN::...}} to Closet tags [[cN::...]], nested ones included
+
+    Each }} closes the innermost open {{, so a cloze inside another one no longer ends
+    the outer one early; a {{ without a matching }} is left as it is.
+    """
+    parts = []
+    # (position in parts, cloze number or None) of every {{ still open
+    opened = []
+    position = 0
+    for match in CLOZE_DELIMITER.finditer(text):
+        parts.append(text[position:match.start()])
+        delimiter = match.group(0)
+        if delimiter == '}}':
+            if opened:
+                index, number = opened.pop()
+                if number is not None:
+                    parts[index] = f"[[c{number}::"
+                    delimiter = ']]'
+        else:
+            opened.append((len(parts), match.group(1)))
+        parts.append(delimiter)
+        position = match.end()
+    if not parts:
+        return text
+    parts.append(text[position:])
+    return ''.join(parts)
+
+def normalize(text: str) -> Tuple[str, int]:
+    """Normalizes a block in a single scan, returning the new text and the highest tag number"""
+    if not text:
+        return text, 0
+    return rebuild(text, tokenize(text))
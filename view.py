@@ -1,6 +1,8 @@
 # view.py
-from aqt.qt import QDialog, QVBoxLayout, QLabel, QComboBox, QPushButton, QCheckBox, QMenu, QAction
+from aqt.qt import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton, QCheckBox, QMenu, QAction, QTextBrowser, QTimer, QFileDialog
 from aqt import mw
+from aqt.utils import tooltip
+import html
 
 class ClosetConfigDialog(QDialog):
     def __init__(self, parent=None, current_config=None, on_save=None):
@@ -31,6 +33,10 @@ class ClosetConfigDialog(QDialog):
         self.deck_name_checkbox.setChecked(self.current_config.get("show_deck_name", True))
         layout.addWidget(self.deck_name_checkbox)
 
+        self.runtime_theme_checkbox = QCheckBox("Apply the theme at render time (desktop only, note type untouched)")
+        self.runtime_theme_checkbox.setChecked(self.current_config.get("theme_mode") == "runtime")
+        layout.addWidget(self.runtime_theme_checkbox)
+
         # Save button
         button_box = QPushButton("Save")
         button_box.clicked.connect(self.save_settings)
@@ -43,15 +49,176 @@ class ClosetConfigDialog(QDialog):
             config = {
                 "closet_color": self.combo_box.currentText(),
                 "highlight_all_cloze": self.highlight_checkbox.isChecked(),
-                "show_deck_name": self.deck_name_checkbox.isChecked()
+                "show_deck_name": self.deck_name_checkbox.isChecked(),
+                "theme_mode": "runtime" if self.runtime_theme_checkbox.isChecked() else "template"
             }
             self.on_save(config)
         self.accept()
 
+class ClozeMigrationDialog(QDialog):
+    def __init__(self, parent=None, selected_count=0, deck_names=(), on_run=None):
+        super().__init__(parent)
+        self.selected_count = selected_count
+        self.deck_names = list(deck_names)
+        self.on_run = on_run
+        self.setup_ui()
+
+    def setup_ui(self):
+        self.setWindowTitle("Convert Cloze Notes to Closet")
+        layout = QVBoxLayout()
+
+        layout.addWidget(QLabel("Notes to convert"))
+        self.scope_combo = QComboBox()
+        if self.selected_count:
+            self.scope_combo.addItem(f"Selected notes ({self.selected_count})", None)
+        for name in self.deck_names:
+            self.scope_combo.addItem(f"Deck: {name}", name)
+        layout.addWidget(self.scope_combo)
+
+        self.dry_run_checkbox = QCheckBox("Dry run: only report what would change")
+        self.dry_run_checkbox.setChecked(True)
+        layout.addWidget(self.dry_run_checkbox)
+
+        run_button = QPushButton("Run")
+        run_button.clicked.connect(self.run)
+        layout.addWidget(run_button)
+
+        self.setLayout(layout)
+
+    def run(self):
+        if self.on_run:
+            self.on_run(self.scope_combo.currentData(), self.dry_run_checkbox.isChecked())
+        self.accept()
+
+class TagSummaryDialog(QDialog):
+    def __init__(self, parent=None, summary=None):
+        super().__init__(parent)
+        self.summary = summary
+        self.setup_ui()
+
+    def setup_ui(self):
+        self.setWindowTitle("Closet Tag Summary")
+        self.resize(520, 480)
+        layout = QVBoxLayout()
+        self.browser = QTextBrowser()
+        self.browser.setHtml(self.render(self.summary))
+        layout.addWidget(self.browser)
+        self.setLayout(layout)
+
+    def render(self, summary):
+        if not summary or not summary["notes"]:
+            return "<p>The tag index is empty. Run \"Update Closet Cards\" to build it.</p>"
+        parts = [f"<h3>{summary['notes']} Closet notes</h3>", "<table border='1' cellpadding='3'>",
+                 "<tr><th>Tags</th><th>Notes with that many tags</th><th>Notes with that highest tag</th></tr>"]
+        for label, tag_notes, max_notes in summary["buckets"]:
+            parts.append(f"<tr><td>{html.escape(label)}</td><td>{tag_notes}</td><td>{max_notes}</td></tr>")
+        parts.append("</table><h3>Tag kinds</h3><table border='1' cellpadding='3'>")
+        parts.append("<tr><th>Kind</th><th>Notes</th><th>Tags</th></tr>")
+        for kind, notes, tags in summary["kinds"]:
+            parts.append(f"<tr><td>{html.escape(kind)}</td><td>{notes}</td><td>{tags}</td></tr>")
+        parts.append("</table><p>Search them in the Browser with e.g. <code>closet:mix</code>, "
+                     "<code>closet:c3</code>, <code>closet:max&gt;20</code> or <code>closet:c&gt;20</code>.</p>")
+        return "".join(parts)
+
+class PerformanceDialog(QDialog):
+    REFRESH_INTERVAL_MS = 2000
+    HISTORY_ROWS = 25
+
+    def __init__(self, parent=None, stats=None):
+        super().__init__(parent)
+        self.stats = stats
+        self.setup_ui()
+        self.refresh()
+
+    def setup_ui(self):
+        self.setWindowTitle("Closet Performance")
+        self.resize(760, 620)
+        layout = QVBoxLayout()
+
+        self.browser = QTextBrowser()
+        layout.addWidget(self.browser)
+
+        buttons = QHBoxLayout()
+        for label, callback in (("Refresh", self.refresh), ("Export JSON", self.export), ("Reset", self.reset)):
+            button = QPushButton(label)
+            button.clicked.connect(callback)
+            buttons.addWidget(button)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        # Keeps the numbers live while the panel is open
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(self.REFRESH_INTERVAL_MS)
+
+    @staticmethod
+    def _table(headers, rows):
+        head = "".join(f"<th align='left'>{html.escape(str(header))}</th>" for header in headers)
+        body = "".join(
+            "<tr>" + "".join(f"<td>{html.escape(str(cell))}</td>" for cell in row) + "</tr>"
+            for row in rows
+        )
+        return f"<table cellspacing='0' cellpadding='3' border='1'><tr>{head}</tr>{body}</table>"
+
+    def render(self, snapshot):
+        totals = snapshot["totals"]
+        counters = snapshot["counters"]
+        cache = snapshot["sources"].get("block_cache", {})
+        scanned = totals.get("notes_scanned", 0)
+        modified = totals.get("notes_modified", 0)
+        summary = [
+            ("Update passes", totals.get("passes", 0)),
+            ("Notes scanned", scanned),
+            ("Notes modified", f"{modified} ({modified / scanned:.1%})" if scanned else modified),
+            ("Time in passes", f"{totals.get('pass_ms', 0):.0f} ms"),
+            ("Block cache hit rate", f"{cache.get('hit_rate', 0):.1%} of {cache.get('hits', 0) + cache.get('misses', 0)} lookups"),
+            ("Block cache entries", cache.get("entries", 0)),
+            ("Model saves", counters.get("model_saves", 0)),
+            ("Schema changes", counters.get("schema_changes", 0)),
+            ("Uptime", f"{snapshot['uptime_s']:.0f} s"),
+        ]
+        for key, value in sorted(counters.items()):
+            if key not in ("model_saves", "schema_changes"):
+                summary.append((key, round(value, 3) if isinstance(value, float) else value))
+        hooks = [
+            (h["hook"], h["handler"].rpartition(".")[2], h["calls"], h["errors"], h["mean_ms"], h["max_ms"], h["total_ms"])
+            for h in snapshot["hooks"]
+        ]
+        errors = list(snapshot["errors"].items())
+        history = [
+            (h["time"], h["kind"], h.get("scanned", ""), h.get("modified", ""), h["ms"], "yes" if h.get("cancelled") else "")
+            for h in reversed(snapshot["history"][-self.HISTORY_ROWS:])
+        ]
+        return (
+            "<h3>Summary</h3>" + self._table(("Statistic", "Value"), summary)
+            + "<h3>Hooks</h3>" + self._table(("Hook", "Handler", "Calls", "Errors", "Mean ms", "Max ms", "Total ms"), hooks)
+            + "<h3>Errors</h3>" + (self._table(("Error", "Count"), errors) if errors else "<p>No errors.</p>")
+            + "<h3>Recent activity</h3>" + self._table(("Time", "Kind", "Scanned", "Modified", "ms", "Cancelled"), history)
+        )
+
+    def refresh(self):
+        scroll = self.browser.verticalScrollBar().value()
+        self.browser.setHtml(self.render(self.stats.snapshot()))
+        self.browser.verticalScrollBar().setValue(scroll)
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Closet Performance", "closet_performance.json", "JSON (*.json)")
+        if path:
+            self.stats.export(path)
+            tooltip(f"Exported to {path}")
+
+    def reset(self):
+        self.stats.reset()
+        self.refresh()
+
 class ClosetMenu:
-    def __init__(self, on_update_cards=None, on_open_settings=None):
+    def __init__(self, on_update_cards=None, on_open_settings=None, on_open_performance=None,
+                 on_open_tag_summary=None, on_convert_runtime=None):
         self.on_update_cards = on_update_cards
         self.on_open_settings = on_open_settings
+        self.on_open_performance = on_open_performance
+        self.on_open_tag_summary = on_open_tag_summary
+        self.on_convert_runtime = on_convert_runtime
 
     def setup_menu(self):
         closet_menu = QMenu("Closet", mw)
@@ -64,5 +231,21 @@ class ClosetMenu:
         config_action.triggered.connect(lambda: self.on_open_settings() if self.on_open_settings else None)
         closet_menu.addAction(config_action)
 
+        performance_action = QAction("Performance", mw)
+        performance_action.triggered.connect(lambda: self.on_open_performance() if self.on_open_performance else None)
+        closet_menu.addAction(performance_action)
+
+        summary_action = QAction("Tag Summary", mw)
+        summary_action.triggered.connect(lambda: self.on_open_tag_summary() if self.on_open_tag_summary else None)
+        closet_menu.addAction(summary_action)
+
+        runtime_menu = closet_menu.addMenu("Closet Runtime")
+        externalize_action = QAction("Move Script to Media Folder", mw)
+        externalize_action.triggered.connect(lambda: self.on_convert_runtime(True) if self.on_convert_runtime else None)
+        runtime_menu.addAction(externalize_action)
+        inline_action = QAction("Put Script Back Inline", mw)
+        inline_action.triggered.connect(lambda: self.on_convert_runtime(False) if self.on_convert_runtime else None)
+        runtime_menu.addAction(inline_action)
+
         mw.form.menuTools.addMenu(closet_menu)
         return closet_menu
\ No newline at end of file
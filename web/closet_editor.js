@@ -0,0 +1,131 @@
+/*
+ * Closet tag insertion and single-field updates, injected into the editor webview.
+ *
+ * Wrapping the selection and choosing the next cloze number happen here, on the
+ * live field DOM, so a keypress never waits for a round trip to Python. The
+ * editor's own input handling then sends the changed field back to Python.
+ */
+(function () {
+    "use strict";
+
+    var CLOZE_NUMBER = /\[\[c(\d+)::/g;
+    var enabled = false;
+
+    /* Rich text editables of every field: shadow roots in current editors, .field elements in older ones */
+    function editables() {
+        var found = [];
+        document.querySelectorAll(".rich-text-editable").forEach(function (host) {
+            if (host.shadowRoot) {
+                found.push.apply(found, host.shadowRoot.querySelectorAll("anki-editable"));
+            }
+        });
+        return found.length ? found : Array.prototype.slice.call(document.querySelectorAll(".field"));
+    }
+
+    /* One more than the highest [[cN:: number in any field of the note */
+    function nextNumber() {
+        var highest = 0;
+        editables().forEach(function (editable) {
+            var text = editable.textContent, match;
+            CLOZE_NUMBER.lastIndex = 0;
+            while ((match = CLOZE_NUMBER.exec(text))) {
+                highest = Math.max(highest, parseInt(match[1], 10));
+            }
+        });
+        return highest + 1;
+    }
+
+    /* Selection of the focused field, looking inside the shadow root that holds it */
+    function selection() {
+        var root = document;
+        while (root.activeElement && root.activeElement.shadowRoot) {
+            root = root.activeElement.shadowRoot;
+        }
+        return root.getSelection ? root.getSelection() : document.getSelection();
+    }
+
+    /* Replaces the selected text with [[cN::text]]; returns whether anything was wrapped */
+    function wrapSelection() {
+        var current = selection();
+        var text = current ? current.toString().trim() : "";
+        if (!text) {
+            return false;
+        }
+        return document.execCommand("insertText", false, "[[c" + nextNumber() + "::" + text + "]] ");
+    }
+
+    /* Caret position in the field as a number of characters, or -1 when the caret is elsewhere */
+    function caretOffset(editable) {
+        var current = selection();
+        if (!current || !current.rangeCount || !editable.contains(current.focusNode)) {
+            return -1;
+        }
+        var range = document.createRange();
+        range.selectNodeContents(editable);
+        range.setEnd(current.focusNode, current.focusOffset);
+        return range.toString().length;
+    }
+
+    /* Puts the caret back at a character offset, or at the end when the text got shorter */
+    function restoreCaret(editable, offset) {
+        var walker = document.createTreeWalker(editable, NodeFilter.SHOW_TEXT);
+        var node, last = null;
+        while ((node = walker.nextNode())) {
+            last = node;
+            if (offset <= node.length) {
+                break;
+            }
+            offset -= node.length;
+        }
+        var current = selection();
+        if (!current) {
+            return;
+        }
+        var range = document.createRange();
+        if (last) {
+            range.setStart(last, Math.min(offset, last.length));
+        } else {
+            range.selectNodeContents(editable);
+        }
+        range.collapse(true);
+        current.removeAllRanges();
+        current.addRange(range);
+    }
+
+    /* Replaces the HTML of one field and fires an input event so the editor saves it like typed text */
+    function setFieldHtml(index, html) {
+        var editable = editables()[index];
+        if (!editable) {
+            return false;
+        }
+        if (editable.innerHTML === html) {
+            return true;
+        }
+        var offset = caretOffset(editable);
+        editable.innerHTML = html;
+        if (offset >= 0) {
+            restoreCaret(editable, offset);
+        }
+        editable.dispatchEvent(new Event("input", { bubbles: true, composed: true }));
+        return true;
+    }
+
+    /* Ctrl+Shift+C (Cmd+Shift+C on macOS) wraps the selection on Closet notes, before the editor's own cloze shortcut */
+    document.addEventListener("keydown", function (event) {
+        if (!enabled || !event.shiftKey || !(event.ctrlKey || event.metaKey) || event.code !== "KeyC") {
+            return;
+        }
+        event.preventDefault();
+        event.stopImmediatePropagation();
+        wrapSelection();
+    }, true);
+
+    window.ClosetEditor = {
+        nextNumber: nextNumber,
+        setFieldHtml: setFieldHtml,
+        wrapSelection: wrapSelection,
+        setEnabled: function (value) {
+            enabled = Boolean(value);
+        },
+    };
+})();
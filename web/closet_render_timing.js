@@ -0,0 +1,63 @@
+/*
+ * Card render timing, injected into the reviewer webview.
+ *
+ * Times each question and answer from the moment the reviewer receives the
+ * card until the frame after Anki ran its onShownHook callbacks, that is after
+ * the card's scripts and MathJax, and reports it to the add-on's performance panel.
+ */
+(function () {
+    "use strict";
+
+    /* Cards handed to the reviewer whose update has not started yet, oldest first */
+    var waiting = [];
+
+    function reporter(card) {
+        return function () {
+            requestAnimationFrame(function () {
+                pycmd("closet:render:" + card.side + ":" + (performance.now() - card.start).toFixed(2));
+            });
+        };
+    }
+
+    /*
+     * _showQuestion and _showAnswer only queue the update. When it starts, it
+     * empties onShownHook in place and pushes Anki's own callback, so a push
+     * onto the empty array marks the start of the oldest waiting card, and its
+     * reporter is added right after. If the reviewer replaces the array
+     * instead, nothing is reported rather than a wrong time.
+     */
+    function watchShownHook() {
+        var hook = window.onShownHook;
+        if (!Array.isArray(hook) || hook.closetTimed) {
+            return;
+        }
+        hook.push = function () {
+            var starting = this.length === 0 && waiting.length > 0;
+            var length = Array.prototype.push.apply(this, arguments);
+            if (starting) {
+                length = Array.prototype.push.call(this, reporter(waiting.shift()));
+            }
+            return length;
+        };
+        hook.closetTimed = true;
+    }
+
+    function timed(name, side) {
+        var original = window[name];
+        if (typeof original !== "function") {
+            return;
+        }
+        window[name] = function () {
+            watchShownHook();
+            if (waiting.length >= 8) {
+                // The updates are not being observed; keep the list from growing
+                waiting.shift();
+            }
+            waiting.push({ side: side, start: performance.now() });
+            return original.apply(this, arguments);
+        };
+    }
+
+    timed("_showQuestion", "question");
+    timed("_showAnswer", "answer");
+})();